@@ -6,9 +6,12 @@ Purpose: Searches through a BIDS dir (originally used on the ngdr) to look for a
 """
 import os
 import csv
+import time
 import boto3
+import sqlite3
 import argparse
-from glob import glob
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 
 def _cli():
     """
@@ -21,11 +24,26 @@ def _cli():
     )
     parser.add_argument(
         '--output_file', required=True, 
-        help='Path to the file which will contain the subjects and sessions that are missing'
+        help='Path to the file which will contain the subjects and sessions that are missing. '
+             'With --manifest, the path to the presence matrix csv'
     )
     parser.add_argument(
-        '--search', required=True,
-        help='The file or folder that you are searching for. You will also need to specify if it is a folder or a file'
+        '--search', nargs='+',
+        help='The file or folder that you are searching for. You will also need to specify if it is a folder or a file. '
+             'More than one can be given and they are all checked in the same pass over the directory or bucket'
+    )
+    parser.add_argument(
+        '--manifest',
+        help='Instead of --search, path to a txt file of the paths expected in every session, one per line, '
+             'relative to the session folder (e.g. anat/, executivesummary/, files/summary.html). End folders with "/". '
+             'Writes a subject x session csv to --output_file with a column for each path (1 found, 0 missing), '
+             'and a list of the subjects and sessions missing each path next to it'
+    )
+    parser.add_argument(
+        '--workers', default=8, type=int,
+        help='Number of threads used to walk the subject directories on tier1, or the number of key ranges of an s3 path '
+             'listed in parallel, defaults to 8. Use 1 to list an s3 path in a single sweep. '
+             'Each thread is mostly waiting on metadata or listing calls, so this can be well above the number of cores'
     )
     parser.add_argument(
         '--host', default= 'https://s3.msi.umn.edu', type=str,
@@ -42,10 +60,44 @@ def _cli():
     )
     parser.add_argument(
         '--sub_list',
-        help='Path to a file with the list of subjects in the s3 bucket with an expected format of "sub-ID" with one subject per line. Must be a txt or csv file'
+        help='Path to a file with the list of subjects in the s3 bucket with an expected format of "sub-ID" with one subject per line. Must be a txt or csv file. '
+             'If not given, every sub- folder found in the s3 path is checked'
+    )
+
+    parser.add_argument(
+        '--per_subject', action="store_true",
+        help='List each subject in --sub_list on its own instead of listing the whole s3 path, '
+             'quicker when the list is a small part of a large bucket. Up to --concurrency subjects are listed at once'
+    )
+    parser.add_argument(
+        '--concurrency', default=16, type=int,
+        help='Most s3 requests in flight at once for --per_subject, also the size of the s3 connection pool, defaults to 16'
+    )
+    parser.add_argument(
+        '--max_attempts', default=10, type=int,
+        help='Times each s3 request is tried before giving up, backing off between tries when s3 is throttling or erroring. '
+             'Defaults to 10'
+    )
+    parser.add_argument(
+        '--cache',
+        help='Path to an SQLite file that keeps a snapshot of each s3 listing (key, size, ETag and LastModified). '
+             'Later searches of the same bucket path are answered from the snapshot until it is older than --cache_ttl. '
+             'The file is created if it does not exist'
+    )
+    parser.add_argument(
+        '--cache_ttl', default=24, type=float,
+        help='Hours a cached s3 listing is used for before the path is listed again, defaults to 24'
+    )
+    parser.add_argument(
+        '--refresh', action="store_true",
+        help='List the s3 path again and replace its cached snapshot, however old it is'
+    )
+    parser.add_argument(
+        '--refresh_prefix', nargs='+', default=[],
+        help='Only list these folders of the s3 path again (e.g. sub-NDARINVXXXXXXXX/), updating them in the cached snapshot'
     )
 
-    group = parser.add_mutually_exclusive_group(required=True)
+    group = parser.add_mutually_exclusive_group()
 
     group.add_argument(
         '--folder', action="store_true",
@@ -58,66 +110,292 @@ def _cli():
 
     return vars(parser.parse_args())
 
+def list_dir(dir_path):
+    # Returns {name: is_dir} for everything in dir_path, or None if it doesn't exist
+    # DirEntry.is_dir() uses the type returned with the listing, so there's no extra stat per entry
+    try:
+        with os.scandir(dir_path) as entries:
+            return {entry.name: entry.is_dir() for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
 def grab_sub_dirs(input_dir):
-    # Returns list of top level subject directories in input_dir
-    sub_dirs = []
-    for dir in os.listdir(input_dir): ## change to be scandir (can check below checks quicker)
-        if dir.startswith("sub-") and os.path.isdir(os.path.join(input_dir, dir)):
-            sub_dirs.append(dir)
-    return dir
-
-def check_for_ses(sub_dir):
-    # Returns true if there are session folders in a subject directory 
-    return bool(glob(os.path.join(sub_dir, "ses-*")))
-
-def search_tier1(input_dir, output_file, search_file):
+    # Returns sorted list of top level subject directories in input_dir
+    return sorted(name for name, is_dir in list_dir(input_dir).items() if name.startswith("sub-") and is_dir)
+
+def find_search_target(base_dir, search_target, listings, folder=False):
+    # Returns true if search_target (a path relative to base_dir) exists, walking down from base_dir one listing at a time
+    # listings caches each directory listed, so targets with the same parent folders only list them once
+    dir_path = base_dir
+    for part in search_target.strip("/").split("/"):
+        if dir_path not in listings:
+            listings[dir_path] = list_dir(dir_path)
+        if not listings[dir_path] or part not in listings[dir_path]:
+            return False
+        dir_path = os.path.join(dir_path, part)
+    if folder:
+        # an empty folder counts as missing
+        if dir_path not in listings:
+            listings[dir_path] = list_dir(dir_path)
+        return bool(listings[dir_path])
+    return True
+
+def check_subject_dir(input_dir, sub, search_targets, folder=False):
+    # Returns (sub, ses, search_target, found) for every search target in each of one subject's sessions
+    # Search targets ending in "/" are always treated as folders
+    sub_dir = os.path.join(input_dir, sub)
+    listings = {sub_dir: list_dir(sub_dir)}
+    sessions = sorted(name for name, is_dir in listings[sub_dir].items() if name.startswith("ses-") and is_dir)
+    presence = []
+    for session_dir in sessions or [None]:
+        base_dir = os.path.join(sub_dir, session_dir) if session_dir else sub_dir
+        for search_target in search_targets:
+            found = find_search_target(base_dir, search_target, listings, folder or search_target.endswith("/"))
+            presence.append((sub, session_dir, search_target, found))
+    return presence
+
+def check_tier1(input_dir, search_targets, workers=8, folder=False):
+    # Returns (sub, ses, search_target, found) for every subject, session and search target in one walk of input_dir
     sub_dirs = grab_sub_dirs(input_dir)
-    missing_info = [] 
-    # Iterate through top-level "sub-" directories
-    for sub in sub_dirs:
-        sub_dir = os.path.join(input_dir, sub)
-        ses_exist = check_for_ses(sub_dir)
-        if ses_exist:
-            for session_dir in os.listdir(sub_dir):
-                file_path = os.path.join(input_dir, sub, session_dir, search_file)
-                if not os.path.exists(file_path):
-                    missing_info.append(f"{sub},{session_dir}")
-        elif not ses_exist:
-            file_path = os.path.join(input_dir, sub, search_file)
-            if not os.path.exists(file_path):
-                missing_info.append(sub)
-    with open(output_file, 'w') as output: 
-        output.write("\n".join(missing_info))
+    # Each subject is independent and mostly waiting on metadata calls, so they're spread across threads
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return [row for presence_by_sub in executor.map(
+            lambda sub: check_subject_dir(input_dir, sub, search_targets, folder), sub_dirs) for row in presence_by_sub]
+
+def search_tier1(input_dir, output_file, search_targets, workers=8, folder=False):
+    if isinstance(search_targets, str):
+        search_targets = [search_targets]
+    presence = check_tier1(input_dir, search_targets, workers, folder)
+    output_missing_info(output_file, [row[:3] for row in presence if not row[3]], search_targets)
+
+def split_s3_path(s3_path):
+    # Returns the bucket name and the key prefix of an s3:// path, the prefix ending in "/" unless it's empty
+    bucket, _, prefix = s3_path[len("s3://"):].partition("/")
+    prefix = prefix.strip("/")
+    return bucket, f"{prefix}/" if prefix else ""
 
-def search_empty_s3_folders(input_directory, output_file, search_term, s3): ## Hasn't been tested, unsure of functionality
-    print("Search for s3 dir")
-    with open(output_file, 'w') as output:
-        bucket = s3.Bucket(input_directory)
-        objects = bucket.objects.filter(Prefix=search_term)
+def sweep_s3_prefix(s3, bucket, prefix, delimiter=None):
+    # Returns the objects and common prefixes under prefix, following list_objects_v2 past its 1000 key pages
+    list_kwargs = {"Bucket": bucket, "Prefix": prefix}
+    if delimiter:
+        list_kwargs["Delimiter"] = delimiter
+    objects = []
+    common_prefixes = []
+    for page in s3.get_paginator("list_objects_v2").paginate(**list_kwargs):
+        objects.extend(page.get("Contents", []))
+        common_prefixes.extend(common_prefix["Prefix"] for common_prefix in page.get("CommonPrefixes", []))
+    return objects, common_prefixes
 
-        if len(list(objects)) > 0:
-            print("dir exists")
+def sweep_s3_range(s3, bucket, prefix, first_key, end_key=None):
+    # Returns the objects inside the top level folders under prefix with keys from first_key up to (not including) end_key
+    objects = []
+    # StartAfter skips straight to the range, keys just before first_key are filtered out below
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix, StartAfter=first_key[:-1]):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if end_key is not None and key >= end_key:
+                return objects
+            # objects directly under prefix were already listed with the top level folders
+            if key >= first_key and "/" in key[len(prefix):]:
+                objects.append(obj)
+    return objects
+
+def list_s3_inventory(s3, bucket, prefix="", workers=1):
+    # Returns every object under prefix, either from one sweep or from workers sweeps over separate ranges of the
+    # top level folders, run in parallel. Each range is still paged 1000 keys at a time rather than listed per folder
+    if workers <= 1:
+        return sweep_s3_prefix(s3, bucket, prefix)[0]
+    objects, top_level_folders = sweep_s3_prefix(s3, bucket, prefix, delimiter="/")
+    if not top_level_folders:
+        return objects
+    top_level_folders.sort()
+    range_size = -(-len(top_level_folders) // workers)
+    first_keys = top_level_folders[::range_size]
+    end_keys = first_keys[1:] + [None]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for range_objects in executor.map(lambda key_range: sweep_s3_range(s3, bucket, prefix, *key_range), zip(first_keys, end_keys)):
+            objects.extend(range_objects)
+    return objects
+
+def open_s3_cache(cache_path):
+    # Opens (or creates) the SQLite file that keeps the s3 listing snapshots
+    s3_cache = sqlite3.connect(cache_path)
+    s3_cache.execute(
+        "CREATE TABLE IF NOT EXISTS s3_objects (bucket TEXT, key TEXT, size INTEGER, etag TEXT, last_modified TEXT, "
+        "PRIMARY KEY (bucket, key)) WITHOUT ROWID"
+    )
+    s3_cache.execute(
+        "CREATE TABLE IF NOT EXISTS s3_listings (bucket TEXT, prefix TEXT, listed_at REAL, PRIMARY KEY (bucket, prefix))"
+    )
+    return s3_cache
+
+def get_prefix_range(prefix):
+    # Returns the first and end key of everything under prefix, so the (bucket, key) primary key can be used to find them
+    if not prefix:
+        return "", None
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def select_cached_objects(s3_cache, bucket, prefix):
+    # Returns the cached objects under prefix in the same shape as list_objects_v2 returns them
+    first_key, end_key = get_prefix_range(prefix)
+    query = "SELECT key, size, etag, last_modified FROM s3_objects WHERE bucket = ? AND key >= ?"
+    query_args = [bucket, first_key]
+    if end_key is not None:
+        query += " AND key < ?"
+        query_args.append(end_key)
+    return [{"Key": key, "Size": size, "ETag": etag, "LastModified": last_modified}
+            for key, size, etag, last_modified in s3_cache.execute(query + " ORDER BY key", query_args)]
+
+def replace_cached_objects(s3_cache, bucket, prefix, objects):
+    # Swap the cached objects under prefix for a new listing of it, and note when it was listed
+    first_key, end_key = get_prefix_range(prefix)
+    with s3_cache:
+        if end_key is None:
+            s3_cache.execute("DELETE FROM s3_objects WHERE bucket = ? AND key >= ?", (bucket, first_key))
         else:
-            print("dir doesn't exist")
-
-def search_s3_files(input_directory, search_term, s3, subject): ## Still developing, works when given a subject list
-    print(f"Search s3 for the file for subject: {subject}")
-
-    raw_bucket_name = input_directory.split('/')[2] ## Maybe figure out a better way to do this
-    objects = s3.list_objects(Bucket=raw_bucket_name, Prefix=subject)
-    contents = objects["Contents"]
-    found_term = False
-    for obj in contents:
-        key = obj["Key"]
-        if search_term in key:
-            found_term = True
-            break
-    return found_term
-
-def output_missing_subjects(output_file, subject):
-    # Write subject with missing term to file 
-    with open(output_file, 'a+') as output:
-        output.write(subject)
+            s3_cache.execute("DELETE FROM s3_objects WHERE bucket = ? AND key >= ? AND key < ?", (bucket, first_key, end_key))
+        s3_cache.executemany("INSERT OR REPLACE INTO s3_objects VALUES (?, ?, ?, ?, ?)", (
+            (bucket, obj["Key"], obj["Size"], obj["ETag"].strip('"'),
+             obj["LastModified"].isoformat() if hasattr(obj["LastModified"], "isoformat") else obj["LastModified"])
+            for obj in objects))
+        s3_cache.execute("INSERT OR REPLACE INTO s3_listings VALUES (?, ?, ?)", (bucket, prefix, time.time()))
+
+def find_cached_listing(s3_cache, bucket, prefix, cache_ttl):
+    # Returns true if prefix, or a path above it, was listed less than cache_ttl hours ago
+    oldest_listed_at = time.time() - cache_ttl * 3600
+    for listed_prefix, listed_at in s3_cache.execute("SELECT prefix, listed_at FROM s3_listings WHERE bucket = ?", (bucket,)):
+        if prefix.startswith(listed_prefix) and listed_at >= oldest_listed_at:
+            return True
+    return False
+
+def list_cached_s3_inventory(s3, s3_cache, bucket, prefix="", workers=1, cache_ttl=24, refresh=False, refresh_prefixes=()):
+    # Returns every object under prefix from the cached snapshot, listing the path again first if the snapshot is missing,
+    # older than cache_ttl hours or refresh is set. Otherwise only refresh_prefixes (relative to prefix) are listed again
+    if refresh or not find_cached_listing(s3_cache, bucket, prefix, cache_ttl):
+        print(f"Listing s3://{bucket}/{prefix} into the cache")
+        replace_cached_objects(s3_cache, bucket, prefix, list_s3_inventory(s3, bucket, prefix, workers))
+    else:
+        for refresh_prefix in refresh_prefixes:
+            refresh_prefix = prefix + refresh_prefix.strip("/") + "/"
+            print(f"Listing s3://{bucket}/{refresh_prefix} into the cache")
+            replace_cached_objects(s3_cache, bucket, refresh_prefix, sweep_s3_prefix(s3, bucket, refresh_prefix)[0])
+    return select_cached_objects(s3_cache, bucket, prefix)
+
+def list_s3_subjects(s3, bucket, prefix, subjects, concurrency=16, s3_cache=None, cache_ttl=24, refresh=False):
+    # Returns the objects in each subject's folder under prefix, listing up to concurrency subjects at once
+    # With a cache, subjects listed less than cache_ttl hours ago are read from it and the rest are added to it
+    subject_prefixes = [f"{prefix}{subject}/" for subject in subjects]
+    if s3_cache is not None and not refresh:
+        uncached_prefixes = [subject_prefix for subject_prefix in subject_prefixes
+                             if not find_cached_listing(s3_cache, bucket, subject_prefix, cache_ttl)]
+    else:
+        uncached_prefixes = subject_prefixes
+    print(f"Listing {len(uncached_prefixes)} subject folders from s3://{bucket}/{prefix}")
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        listed_objects = dict(zip(uncached_prefixes, executor.map(
+            lambda subject_prefix: sweep_s3_prefix(s3, bucket, subject_prefix)[0], uncached_prefixes)))
+    objects = []
+    for subject_prefix in subject_prefixes:
+        if s3_cache is None:
+            objects.extend(listed_objects[subject_prefix])
+            continue
+        # the cache is only written from this thread, sqlite connections can't be shared between threads
+        if subject_prefix in listed_objects:
+            replace_cached_objects(s3_cache, bucket, subject_prefix, listed_objects[subject_prefix])
+        objects.extend(select_cached_objects(s3_cache, bucket, subject_prefix))
+    return objects
+
+def index_s3_inventory(objects, prefix=""):
+    # Returns {top level folder under prefix (the subject): [keys relative to that folder]}
+    # Objects directly under prefix (e.g. sub-XXXX.html) aren't in a folder, so they're skipped like files are on tier1
+    s3_inventory = {}
+    for obj in objects:
+        top_level, in_folder, key = obj["Key"][len(prefix):].partition("/")
+        if in_folder:
+            s3_inventory.setdefault(top_level, []).append(key)
+    return s3_inventory
+
+def search_empty_s3_folders(s3_inventory, search_term, subject):
+    # Returns true if the subject has at least one object inside a search_term folder
+    # s3 has no real folders, so an empty folder and a missing one look the same
+    folder = f"/{search_term.strip('/')}/"
+    return any(folder in f"/{key}" for key in s3_inventory.get(subject, []))
+
+def search_s3_files(s3_inventory, search_term, subject):
+    # Returns true if any of the subject's keys contain search_term
+    return any(search_term in key for key in s3_inventory.get(subject, []))
+
+def search_s3(s3_inventory, output_file, search_targets, subjects=None, folder=False):
+    # Runs every subject and search target against the inventory, without any more requests to s3
+    if subjects is None:
+        subjects = sorted(subject for subject in s3_inventory if subject.startswith("sub-"))
+    search_s3_inventory = search_empty_s3_folders if folder else search_s3_files
+    missing_info = [(subject, None, search_target) for subject in subjects for search_target in search_targets
+                    if not search_s3_inventory(s3_inventory, search_target, subject)]
+    output_missing_info(output_file, missing_info, search_targets)
+
+def check_s3_sessions(s3_inventory, search_targets, subjects=None):
+    # Returns (sub, ses, search_target, found) for every session of every subject in the inventory
+    # Search targets are paths relative to the session folder, folders ending in "/"
+    if subjects is None:
+        subjects = sorted(subject for subject in s3_inventory if subject.startswith("sub-"))
+    presence = []
+    for subject in subjects:
+        session_paths = {}
+        for key in s3_inventory.get(subject, []):
+            session_dir, _, path = key.partition("/")
+            if session_dir.startswith("ses-") and path:
+                session_paths.setdefault(session_dir, set()).add(path)
+            else:
+                session_paths.setdefault(None, set()).add(key)
+        # folders only exist in s3 as the start of a key, so list every folder a key is in
+        session_folders = {session_dir: {path[:end + 1] for path in paths for end, char in enumerate(path) if char == "/"}
+                           for session_dir, paths in session_paths.items()}
+        # subjects with sessions are only checked per session, like check_subject_dir
+        sessions = sorted(session_dir for session_dir in session_paths if session_dir) or [None]
+        for session_dir in sessions:
+            for search_target in search_targets:
+                if search_target.endswith("/"):
+                    found = search_target.lstrip("/") in session_folders.get(session_dir, ())
+                else:
+                    found = search_target.strip("/") in session_paths.get(session_dir, ())
+                presence.append((subject, session_dir, search_target, found))
+    return presence
+
+def get_manifest(manifest_file):
+    # Returns the expected paths in a manifest file, skipping blank lines and comments
+    with open(manifest_file, 'r') as manifest:
+        return [line.strip() for line in manifest if line.strip() and not line.strip().startswith("#")]
+
+def output_presence_matrix(output_file, presence, search_targets):
+    # Write a csv with a row for each subject and session and a 1/0 column for each search target,
+    # then a list of the subjects and sessions missing each search target next to it
+    matrix = {}
+    for sub, session_dir, search_target, found in presence:
+        matrix.setdefault((sub, session_dir), {})[search_target] = int(found)
+    with open(output_file, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(["subject", "session"] + search_targets)
+        for (sub, session_dir), found_targets in matrix.items():
+            writer.writerow([sub, session_dir or ""] + [found_targets[search_target] for search_target in search_targets])
+    output_stem = os.path.splitext(output_file)[0]
+    for search_target in search_targets:
+        target_name = search_target.strip("/").replace("/", "_")
+        output_missing_info(f"{output_stem}_missing_{target_name}.txt",
+                            [row[:3] for row in presence if row[2] == search_target and not row[3]], [search_target])
+
+def output_missing_info(output_file, missing_info, search_targets):
+    # Write each subject (and session) with a missing search target to file, one per line
+    lines = []
+    for sub, session_dir, search_target in missing_info:
+        # only name the target when there's more than one to tell apart, and then always write the
+        # session column (empty for subjects without sessions) so every line has the same columns
+        if len(search_targets) > 1:
+            lines.append(f"{sub},{session_dir or ''},{search_target}")
+        else:
+            lines.append(f"{sub},{session_dir}" if session_dir else sub)
+    with open(output_file, 'w') as output: 
+        output.write("\n".join(lines))
 
 def get_subjects(subject_list_file):
     # Extract subject IDs from text file
@@ -132,42 +410,58 @@ def get_subjects(subject_list_file):
 
     return subject_ids
 
-def create_s3_client(host, access_key, secret_key):
-    # Create s3 client to access bucket 
-    session = boto3.Session()
-    client = session.client('s3', endpoint_url=host, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
-    return client
-
-def create_s3_bucket(host, access_key, secret_key): ## Same as above, I think this will need to be different for bucket searching function
+def create_s3_client(host, access_key, secret_key, max_pool_connections=16, max_attempts=10):
+    # Create s3 client to access bucket, shared by every thread (boto3 clients are thread safe, sessions aren't)
+    # The connection pool needs to be at least as big as the number of threads or they wait on each other for a connection,
+    # and "standard" retries back off with jitter when the endpoint throttles or returns a 5xx
     session = boto3.Session()
-    client = session.client('s3', endpoint_url=host, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+    config = Config(max_pool_connections=max_pool_connections, retries={"total_max_attempts": max_attempts, "mode": "standard"})
+    client = session.client('s3', endpoint_url=host, aws_access_key_id=access_key, aws_secret_access_key=secret_key, config=config)
     return client
 
 if __name__ == '__main__':
     cli_args = _cli()
     input_directory = cli_args["input_dir"]
     output_txt_file = cli_args["output_file"]
-    search_term = cli_args["search"]
+    search_terms = cli_args["search"]
     host = cli_args["host"]
     access_key = cli_args["access_key"]
     secret_key = cli_args["secret_key"]
     sub_list = cli_args["sub_list"]
 
-    if not cli_args["folder"] and not cli_args["file"]:
+    manifest = get_manifest(cli_args["manifest"]) if cli_args["manifest"] else None
+    if manifest is None and not search_terms:
+        raise ValueError("You need to specify what you're searching for with --search or --manifest")
+    if manifest is None and not cli_args["folder"] and not cli_args["file"]:
         raise ValueError("You need to specify if you're searching for a folder or file with the --folder or --file flag")
     
     if "s3://" in input_directory:
         if access_key == "None" or secret_key == "None":
             raise ValueError("You are trying to search a s3 bucket but have not provided your access or secret key. Please specify these values. See the help message for more info.")
         else:
-            s3 = create_s3_client(host, access_key, secret_key)
-            if cli_args["folder"]:
-                search_empty_s3_folders(input_directory, output_txt_file, search_term, s3)
-            elif cli_args["file"]:
-                subjects = get_subjects(sub_list)
-                for sub in subjects:
-                    found_term = search_s3_files(input_directory, search_term, s3, sub)
-                    if not found_term:
-                        output_missing_subjects(output_txt_file, sub)
+            s3 = create_s3_client(host, access_key, secret_key, max(cli_args["concurrency"], cli_args["workers"]), cli_args["max_attempts"])
+            bucket, prefix = split_s3_path(input_directory)
+            subjects = get_subjects(sub_list) if sub_list else None
+            s3_cache = open_s3_cache(cli_args["cache"]) if cli_args["cache"] else None
+            if cli_args["per_subject"]:
+                if subjects is None:
+                    raise ValueError("--per_subject lists each subject in --sub_list, please provide one.")
+                objects = list_s3_subjects(s3, bucket, prefix, subjects, cli_args["concurrency"], s3_cache,
+                                           cli_args["cache_ttl"], cli_args["refresh"])
+            # list the bucket once and answer every subject's search from that listing
+            elif s3_cache is not None:
+                objects = list_cached_s3_inventory(s3, s3_cache, bucket, prefix, cli_args["workers"], cli_args["cache_ttl"],
+                                                   cli_args["refresh"], cli_args["refresh_prefix"])
+            else:
+                objects = list_s3_inventory(s3, bucket, prefix, cli_args["workers"])
+            if s3_cache is not None:
+                s3_cache.close()
+            s3_inventory = index_s3_inventory(objects, prefix)
+            if manifest is not None:
+                output_presence_matrix(output_txt_file, check_s3_sessions(s3_inventory, manifest, subjects), manifest)
+            else:
+                search_s3(s3_inventory, output_txt_file, search_terms, subjects, cli_args["folder"])
+    elif manifest is not None:
+        output_presence_matrix(output_txt_file, check_tier1(input_directory, manifest, cli_args["workers"]), manifest)
     else:
-        search_tier1(input_directory, output_txt_file, search_term)
+        search_tier1(input_directory, output_txt_file, search_terms, cli_args["workers"], cli_args["folder"])
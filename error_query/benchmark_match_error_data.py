@@ -0,0 +1,80 @@
+"""
+Purpose: Times match_error_data from full_error_query.py on a synthetic set of runs (50,000 by default)
+against the list-based join it replaced, which looked up every run with list.index()
+"""
+import random
+import time
+import argparse
+
+from full_error_query import error_strings, match_error_data
+
+
+def _cli():
+    """
+    :return: Dictionary with all validated command-line arguments from the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--runs', type=int, default=50000,
+        help='Number of synthetic runs to join. Default is 50000'
+    )
+    parser.add_argument(
+        '--skip-list-join', dest="skip_list_join", action="store_true",
+        help='Only time the keyed join (the list-based join takes minutes past about 100k runs)'
+    )
+    return vars(parser.parse_args())
+
+
+def make_error_data(runs):
+    # One error string and one set of IDs per run, in the shape find_subject_session_ids returns
+    errors_by_string = {error_string: [] for error_string in error_strings.values()}
+    error_data = {}
+    for run in range(runs):
+        run_number = str(run)
+        errors_by_string[random.choice(list(error_strings.values()))].append(run_number)
+        error_data[run_number] = {
+            'Error_Log_Path': f"/output_logs/abcd-hcp_{run}.err",
+            'Subject_ID': f"NDARINV{run:08d}",
+            'Session_ID': "2YearFollowUpYArm1"
+        }
+    return error_data, errors_by_string
+
+
+def match_error_data_list_join(error_data_lists, errors_by_string):
+    # The previous join: one linear list.index() scan per run
+    matched_error_data = {}
+    for string, run_numbers in errors_by_string.items():
+        for run_number in run_numbers:
+            run_index = error_data_lists['Run_Number'].index(run_number)
+            matched_error_data.setdefault(string, []).append({
+                'Error_Log_Path': error_data_lists['Error_Log_Paths'][run_index],
+                'Subject_ID': error_data_lists['Subject_IDs'][run_index],
+                'Session_ID': error_data_lists['Session_IDs'][run_index]
+            })
+    return matched_error_data
+
+
+def main():
+    cli_args = _cli()
+    random.seed(0)
+    error_data, errors_by_string = make_error_data(cli_args["runs"])
+
+    start = time.perf_counter()
+    keyed = match_error_data(error_data, errors_by_string)
+    print(f"Keyed join of {cli_args['runs']} runs: {time.perf_counter() - start:.3f}s")
+
+    if not cli_args["skip_list_join"]:
+        error_data_lists = {
+            "Run_Number": list(error_data.keys()),
+            "Error_Log_Paths": [data['Error_Log_Path'] for data in error_data.values()],
+            "Subject_IDs": [data['Subject_ID'] for data in error_data.values()],
+            "Session_IDs": [data['Session_ID'] for data in error_data.values()]
+        }
+        start = time.perf_counter()
+        listed = match_error_data_list_join(error_data_lists, errors_by_string)
+        print(f"List join of {cli_args['runs']} runs: {time.perf_counter() - start:.3f}s")
+        print("Both joins match:", keyed == listed)
+
+
+if __name__ == '__main__':
+    main()
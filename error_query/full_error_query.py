@@ -6,20 +6,20 @@
 #       d. sub_ids_csv is a path to a list of subject ids
 #       e. add_error_log_path is a boolean that will add a path to the most recent error log for each subject in the output
 #       f. error_strings allow for new strings to be added to a default dictionary of strings
-#   2. parse through the output_logs_dir and create a unique list of all the run numbers
-#   3. find the most recent .err file associated with each unique run number
+#       g. output_format is either a csv for each error (default) or one combined csv, parquet or feather table
+#   2. list the output_logs_dir once and group the .err files by their run number
+#   3. keep the most recent .err file associated with each unique run number
 #   4. read each error file and find certain error strings, then match information with run number (or sub_id, if using csv input) identifier 
 #   5. using identifier, find subject_id and session_id for each associated error file;
 #      if subject_id and session_id not found within the .err file, extract info from the associated run file in the run_files directory
 #   6. return csvs for each error that contain the associated subject_id and session_id, and the path to the error log that contains the error, if desired
+#      or a single table with a row for each run, its error, the line the error was found on and the log's mtime
 
 # TODO:
 #   - provide a catch for error logs that are missing subject and session information
 #   - add no_sub_id_err_files to its own csv
 #   - test out ability to add in other error strings
 #   - test on a subset of BIDS conversion error logs
-#   - need to consolidate find_subject_session_ids function 
-#   - further edit exception in match_error_data function
 #   - make sure either run files dir or subject list is a required input 
 
 
@@ -30,8 +30,14 @@ import pandas as pd
 import pdb
 import re
 import csv
+import json
+import sqlite3
+import hashlib
+import mmap
 import argparse
 from argparse import RawTextHelpFormatter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 
 # default dictionary of error strings to search for
 error_strings = {
@@ -58,6 +64,25 @@ error_strings = {
     "connection_reset": "error: [Errno 104] Connection reset by peer"
 }
 
+# patterns used to pull the subject and session IDs out of an .err file;
+# the first group of each pattern is the ID that ends up in the output csvs
+id_patterns = {
+    "Subject_ID": r"sub-([a-zA-Z0-9_]+)",
+    "Session_ID": r"ses-([a-zA-Z0-9_]+)"
+}
+
+# logs are scanned as bytes, this many at a time, so memory use doesn't grow with the size of a log
+scan_chunk_bytes = 1024 * 1024
+# the most of an unfinished line carried over from one chunk to the next; error strings and IDs
+# never span lines, so a chunk only needs to carry the line it ends in. The chunk, the carry joined
+# to it and the part of that cut at its last line end are held at once, so the peak memory of scanning
+# one log (per worker) is about 3 * scan_chunk_bytes + 2 * max_carry_bytes, whatever the size of the log.
+# A single line longer than max_carry_bytes is split, and its last max_carry_bytes are scanned again
+# with the next chunk. That overlap finds any error string that crosses the split, but an ID pattern
+# is open-ended, so an ID running up to the split isn't taken until the overlap is rescanned with the
+# rest of its line (see scan_log_content's cut_off)
+max_carry_bytes = 64 * 1024
+
 def main():
     # set the input variables using argument parser
     # change arguments to dashes from underscores
@@ -82,6 +107,31 @@ def main():
     parser.add_argument("-p", "--add_error_log_path", dest="add_error_log_path", action="store_true", default = False, required=False,
                         help="Optional. Include the 'Error_Log_Path' in the CSVs for each .err file."
                         )
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=1, required=False,
+                        help="Optional. Number of processes used to read and classify the .err files. Default is 1.\n"
+                            "Set this to the number of cores requested from SLURM to split the logs across them."
+                        )
+    parser.add_argument("-b", "--bounded_read", dest="bounded_read", nargs=2, type=int, default=None, required=False,
+                        metavar=("HEAD_KB", "TAIL_KB"),
+                        help="Optional. Only read the first HEAD_KB and last TAIL_KB kilobytes of each .err file, e.g. '-b 64 64'.\n"
+                            "Error strings are searched for in both windows and the subject/session IDs in the first one.\n"
+                            "A log is only read in full when no error string is found in the windows or an ID is missing from the head.\n"
+                            "Note: when a log has more than one error string, the one chosen comes from the windows only."
+                        )
+    parser.add_argument("-i", "--index", dest="index_path", default="", required=False,
+                        help="Optional. Path to an SQLite file that keeps the classification of every .err file read.\n"
+                            "On later runs only .err files that are new or have changed (by size, mtime or ctime) are read again,\n"
+                            "the rest of the CSVs are rebuilt from the index. The subject/session IDs parsed from the run_files\n"
+                            "directory are kept there too, and only re-parsed for run files modified since.\n"
+                            "The file is created if it doesn't exist."
+                        )
+    parser.add_argument("-f", "--output_format", dest="output_format", default="per_error_csv", required=False,
+                        choices=["per_error_csv", "csv", "parquet", "feather"],
+                        help="Optional. How the results are written. Default is 'per_error_csv', one CSV for each error.\n"
+                            "'csv', 'parquet' and 'feather' instead write one table, error_query_results.<format>, with a row per run:\n"
+                            "Run_Number, Error_Log_Path, Subject_ID, Session_ID, Error_Name, Error_Line and Error_Log_Mtime.\n"
+                            "'parquet' and 'feather' need pyarrow installed. no_sub_id_errors.csv is written either way."
+                        )
     #parser.add_argument("-remove", "--remove_old_log_files", dest="remove_old_log_files", action="store_true", default = False, required=False,
     #                    help="Optional. Remove old log files that may no longer be necessary.")
     parser.add_argument("-e", "--error_strings", dest="error_strings", nargs="+", default=error_strings, required=False,
@@ -113,73 +163,361 @@ def main():
                         )
     args = parser.parse_args()
 
-    # parse through the output_logs_dir and create a unique list of all the run numbers
-    run_numbers = get_run_numbers(args.output_logs_dir)
-    # find the most recent .err file associated with each unique run number
+    err_index = open_err_index(args.index_path) if args.index_path else None
+    read_window = tuple(kb * 1024 for kb in args.bounded_read) if args.bounded_read else None
     if args.sub_ids_csv == "":
-        most_recent_err_files,no_sub_id_err_files = get_most_recent_err_files(args.output_logs_dir, run_numbers)
+        # list the output_logs_dir once, finding the most recent .err file associated with each unique run number
+        most_recent_err_files = get_most_recent_err_files(args.output_logs_dir)
+        # read each error file once, classifying its error and pulling out its sub/ses IDs
+        err_records = classify_err_files(most_recent_err_files, args.error_strings, workers=args.workers, err_index=err_index, read_window=read_window)
+        no_sub_id_err_files = [record["Error_Log_Path"] for record in err_records.values()
+                               if not (record["Subject_ID"] and record["Session_ID"])]
     else: 
-        most_recent_err_files,no_sub_id_err_files = get_most_recent_err_files_from_id(args.output_logs_dir, args.sub_ids_csv)
-    # read each error file and find certain error strings, then match information with run number identifier
-    errors_by_string, run_numbers_with_error, run_numbers_without_error = find_errors(args.error_strings, most_recent_err_files)
+        err_records,no_sub_id_err_files = get_most_recent_err_files_from_id(args.output_logs_dir, args.sub_ids_csv, args.error_strings, args.workers, err_index, read_window)
+    # sort the classified records by error string, then match information with run number identifier
+    errors_by_string, run_numbers_with_error, run_numbers_without_error = find_errors(args.error_strings, err_records)
     # using run number identifier, find subject_id and session_id for each associated error file
-    error_data = find_subject_session_ids(args.run_files_dir, run_numbers_with_error, run_numbers_without_error, most_recent_err_files)
+    error_data = find_subject_session_ids(args.run_files_dir, run_numbers_with_error, run_numbers_without_error, err_records, err_index)
+    if err_index is not None:
+        err_index.close()
     # match the error data for each error string
     matched_error_data = match_error_data(error_data, errors_by_string)
-    # print the identified information in a csv for each error
-    match_and_print_errors(no_sub_id_err_files,matched_error_data, error_strings, args.output_dir, args.add_error_log_path)
-
-# create a unique list of run numbers from output_logs directory
-def get_run_numbers(output_logs_dir):
-    run_numbers = set()
-    for root, _, files in os.walk(output_logs_dir):
-        for file in files:
-            if file.endswith(".err"):
-                run_number = re.search(r"_(\d+)\.err", file)
-                if run_number:
-                    run_numbers.add(run_number.group(1))
-    return run_numbers
+    if args.output_format == "per_error_csv":
+        # print the identified information in a csv for each error
+        match_and_print_errors(no_sub_id_err_files,matched_error_data, error_strings, args.output_dir, args.add_error_log_path)
+    else:
+        # write every run to a single table instead of a csv for each error
+        write_combined_results(err_records, error_data, error_strings, args.output_dir, args.output_format)
+        write_no_sub_id_csv(no_sub_id_err_files, args.output_dir)
+
+# list every .err file in the output_logs directory with its ctime, in a single pass
+def list_err_files(output_logs_dir):
+    err_file_ctimes = {}
+    with os.scandir(output_logs_dir) as entries:
+        for entry in entries:
+            # skip hidden files, matching what glob("*.err") would return
+            if entry.name.endswith(".err") and not entry.name.startswith(".") and entry.is_file():
+                # DirEntry caches its stat result, so each file is only stat'ed once
+                err_file_ctimes[entry.path] = entry.stat().st_ctime
+    return err_file_ctimes
 
 # find the most recent .err file for each unique run number
-def get_most_recent_err_files(output_logs_dir, run_numbers):
+def get_most_recent_err_files(output_logs_dir):
     most_recent_err_files = {}
-    for run_number in run_numbers:
-        err_files = glob(os.path.join(output_logs_dir, f"*_{run_number}.err"))
-        if err_files:
-            most_recent_err_files[run_number] = max(err_files, key=os.path.getctime)
+    most_recent_ctimes = {}
+    for err_file, ctime in list_err_files(output_logs_dir).items():
+        run_number = re.search(r"_(\d+)\.err", os.path.basename(err_file))
+        if run_number:
+            run_number = run_number.group(1)
+            if run_number not in most_recent_ctimes or ctime > most_recent_ctimes[run_number]:
+                most_recent_err_files[run_number] = err_file
+                most_recent_ctimes[run_number] = ctime
     return most_recent_err_files
 
 
-# if using subject id list, find most recent err file
-def get_most_recent_err_files_from_id(output_logs_dir, sub_ids_csv):
-    # Get all error file paths
-    err_files_df = pd.DataFrame({
-        "err_file_path": glob(os.path.join(output_logs_dir, f"*.err"))
-    })
+# combine every error string and ID pattern into one regex so each log only has to be scanned once
+def build_log_scanner(error_strings, id_patterns=id_patterns, read_window=None):
+    # the first error string is the catch-all for undetermined errors, so it isn't searched for
+    error_strings_list = list(error_strings.values())
+    # the error strings come first so that their dictionary order decides which one wins when two
+    # start at the same place. Everything is compiled as bytes so the logs never have to be decoded.
+    # No alternative is wrapped in a capturing group, since that stops re from skipping ahead to the
+    # bytes that can start a match and makes the search many times slower; the matched error string is
+    # looked up by its text instead, and the IDs are pulled out with their own patterns
+    error_alternatives = [re.escape(error_string.encode()) for error_string in error_strings_list[1:]]
+    id_alternatives = [re.sub(r"^\((?!\?)", "(?:", pattern).encode() for pattern in id_patterns.values()]
+    error_indexes = {}
+    for index, error_string in enumerate(error_strings_list[1:]):
+        error_indexes.setdefault(error_string.encode(), index)
+    return {
+        "error_bytes": [error_string.encode() for error_string in error_strings_list[1:]],
+        "error_alternatives": error_alternatives,
+        "id_alternatives": id_alternatives,
+        # regexes for what is still worth searching for while IDs are missing, built as they're first needed (see get_scan_regex)
+        "regexes": {},
+        "error_indexes": error_indexes,
+        "error_strings": error_strings_list,
+        "id_patterns": {key: re.compile(pattern.encode()) for key, pattern in id_patterns.items()},
+        # (head_bytes, tail_bytes) to only read the ends of each log, or None to read all of it
+        "read_window": read_window
+    }
 
-    # Patterns to find subject and session IDs
-    find_subj = re.compile(r"(sub-NDARINV.{8})")
-    find_ses = re.compile(r"(ses-.*Arm[0-9]{1})")
 
-    # Get each error file's subject and session ID
+# the running result of scanning a log: the index of the highest priority error string found,
+# the line it was found on, and the first match of each ID pattern
+def new_scan_state(scanner):
+    return {"error": None, "line": None, "ids": {key: None for key in scanner["id_patterns"]}}
+
+
+# True once nothing later in a log could change its record
+def is_scan_done(scan_state, scanner):
+    no_error_strings = len(scanner["error_strings"]) == 1
+    return (scan_state["error"] == 0 or no_error_strings) and None not in scan_state["ids"].values()
+
+
+# how many of the error strings, in priority order, could still change a log's record:
+# the ones with a higher priority than the one found so far, or all of them if none has been found
+def get_error_limit(scanner, scan_state):
+    return len(scanner["error_bytes"]) if scan_state["error"] is None else scan_state["error"]
+
+
+# the regex for the ID patterns and the error strings that could still change a log's record.
+# Searching only for these means a log full of a low priority error isn't matched at every line of it
+def get_scan_regex(scanner, scan_state):
+    error_limit = get_error_limit(scanner, scan_state)
+    if error_limit not in scanner["regexes"]:
+        alternatives = scanner["error_alternatives"][:error_limit] + scanner["id_alternatives"]
+        scanner["regexes"][error_limit] = re.compile(b"|".join(alternatives)) if alternatives else None
+    return scanner["regexes"][error_limit]
+
+
+# once every ID has been found only fixed strings are left to search for, which bytes.find does many
+# times faster than re does an alternation of them. Checking them in priority order, the first one in
+# content is the highest priority error string in it
+def find_error_strings(content, scanner, scan_state, position=0):
+    for error_index, error_string in enumerate(scanner["error_bytes"][:get_error_limit(scanner, scan_state)]):
+        match_start = content.find(error_string, position)
+        if match_start != -1:
+            scan_state["error"] = error_index
+            line_start = content.rfind(b"\n", 0, match_start) + 1
+            line_end = content.find(b"\n", match_start + len(error_string))
+            scan_state["line"] = content[line_start:line_end if line_end != -1 else len(content)]
+            return
+
+
+# find the highest priority error string and the first match of each ID pattern in some bytes of a log,
+# carrying on from the scan_state of the earlier parts of the log if given. cut_off is True when content
+# ends partway through a line, in which case an ID reaching the end of content may be missing its end
+# and is left to be found in what follows
+def scan_log_content(content, scanner, scan_state=None, cut_off=False):
+    if scan_state is None:
+        scan_state = new_scan_state(scanner)
+    found_ids = scan_state["ids"]
+    regex = get_scan_regex(scanner, scan_state)
+    position = 0
+    while regex is not None and not is_scan_done(scan_state, scanner):
+        if None not in found_ids.values():
+            find_error_strings(content, scanner, scan_state, position)
+            break
+        match = regex.search(content, position)
+        if not match:
+            break
+        error_index = scanner["error_indexes"].get(match.group())
+        found_new = False
+        if error_index is not None and (scan_state["error"] is None or error_index < scan_state["error"]):
+            scan_state["error"] = error_index
+            line_start = content.rfind(b"\n", 0, match.start()) + 1
+            line_end = content.find(b"\n", match.end())
+            scan_state["line"] = content[line_start:line_end if line_end != -1 else len(content)]
+            found_new = True
+        # an ID can start at the same position as another match, so check every position against the missing IDs
+        for key, pattern in scanner["id_patterns"].items():
+            if found_ids[key] is None:
+                id_match = pattern.match(content, match.start())
+                if id_match and not (cut_off and id_match.end() == len(content)):
+                    found_ids[key] = id_match.group(1).decode(errors="replace")
+                    found_new = True
+        if found_new:
+            regex = get_scan_regex(scanner, scan_state)
+        # matches can overlap, so search again from the next byte rather than from the end of this match
+        position = match.start() + 1
+    return scan_state
+
+
+# scan an open binary log in fixed-size chunks, cut at line ends so no match is split between chunks
+def scan_log_stream(log_file, scanner, scan_state=None):
+    if scan_state is None:
+        scan_state = new_scan_state(scanner)
+    carry = b""
+    while not is_scan_done(scan_state, scanner):
+        chunk = log_file.read(scan_chunk_bytes)
+        if not chunk:
+            return scan_log_content(carry, scanner, scan_state)
+        content = carry + chunk
+        line_end = content.rfind(b"\n") + 1
+        if len(content) - line_end <= max_carry_bytes:
+            carry = content[line_end:]
+            content = content[:line_end]
+        else:
+            # the line is too long to carry whole, so scan it now and rescan its tail with the next chunk
+            carry = content[-max_carry_bytes:]
+            scan_log_content(content, scanner, scan_state, cut_off=True)
+            continue
+        scan_log_content(content, scanner, scan_state)
+    return scan_state
+
+
+# read only the first head_bytes and last tail_bytes of a log; returns None if the log isn't bigger than both windows
+def read_log_windows(err_file_path, read_window):
+    head_bytes, tail_bytes = read_window
+    with open(err_file_path, 'rb') as err_file:
+        size = os.fstat(err_file.fileno()).st_size
+        if size <= head_bytes + tail_bytes:
+            return None
+        head = err_file.read(head_bytes)
+        err_file.seek(size - tail_bytes)
+        tail = err_file.read(tail_bytes)
+    return head, tail
+
+
+# read an .err file once and return its classification record
+def classify_err_file(err_file_path, scanner):
+    windows = read_log_windows(err_file_path, scanner["read_window"]) if scanner["read_window"] else None
+    scan_state = None
+    if windows:
+        head, tail = windows
+        # the head window ends wherever head_bytes falls, so an ID cut by it is left for the full read
+        scan_state = scan_log_content(head, scanner, cut_off=True)
+        tail_state = scan_log_content(tail, scanner)
+        if tail_state["error"] is not None and (scan_state["error"] is None or tail_state["error"] < scan_state["error"]):
+            scan_state["error"] = tail_state["error"]
+            scan_state["line"] = tail_state["line"]
+    # only read the whole log when the windows didn't give an answer
+    if scan_state is None or scan_state["error"] is None or None in scan_state["ids"].values():
+        with open(err_file_path, 'rb') as err_file:
+            scan_state = scan_log_stream(err_file, scanner)
+
+    # runs without any of the error strings fall back to the undetermined error string
+    error_strings_list = scanner["error_strings"]
+    best_error = scan_state["error"]
+    record = {"Error_Log_Path": err_file_path,
+              "Error_String": error_strings_list[0] if best_error is None else error_strings_list[best_error + 1],
+              "Error_Line": None if best_error is None else scan_state["line"].decode(errors="replace").strip(),
+              "Error_Log_Mtime": os.stat(err_file_path).st_mtime_ns / 1e9}
+    record.update(scan_state["ids"])
+    return record
+
+
+# each worker process builds its own scanner once instead of receiving it with every chunk of logs
+def init_classify_worker(error_strings, id_patterns, read_window):
+    global worker_scanner
+    worker_scanner = build_log_scanner(error_strings, id_patterns, read_window)
+
+
+def classify_err_file_in_worker(err_file_path):
+    return classify_err_file(err_file_path, worker_scanner)
+
+
+# classify a list of .err files, returning their records in the same order as err_file_paths
+def classify_err_paths(err_file_paths, error_strings, id_patterns=id_patterns, workers=1, err_index=None, read_window=None):
+    if err_index is not None:
+        return classify_indexed_err_paths(err_file_paths, error_strings, id_patterns, workers, err_index, read_window)
+    if workers <= 1 or len(err_file_paths) <= 1:
+        scanner = build_log_scanner(error_strings, id_patterns, read_window)
+        return [classify_err_file(err_file_path, scanner) for err_file_path in err_file_paths]
+    # hand the logs out in chunks so each worker isn't waiting on the queue after every file,
+    # while keeping the chunks small enough that the workers finish at about the same time
+    chunksize = max(1, min(500, len(err_file_paths) // (workers * 8)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_classify_worker,
+                             initargs=(error_strings, id_patterns, read_window)) as executor:
+        return list(executor.map(classify_err_file_in_worker, err_file_paths, chunksize=chunksize))
+
+
+# open (or create) the index of classified .err files
+def open_err_index(index_path):
+    err_index = sqlite3.connect(index_path)
+    err_index.execute(
+        "CREATE TABLE IF NOT EXISTS err_logs ("
+        "path TEXT PRIMARY KEY, mtime_ns INTEGER, ctime_ns INTEGER, size INTEGER, scanner_key TEXT, "
+        "run_number TEXT, error_string TEXT, subject_id TEXT, session_id TEXT, ids TEXT, error_line TEXT)"
+    )
+    err_index.execute(
+        "CREATE TABLE IF NOT EXISTS run_files ("
+        "path TEXT PRIMARY KEY, mtime_ns INTEGER, subject_id TEXT, session_id TEXT)"
+    )
+    return err_index
+
+
+# identify the error strings, ID patterns and read window a record was made with, so changing them invalidates the index
+def get_scanner_key(error_strings, id_patterns, read_window=None):
+    scanner_spec = json.dumps([list(error_strings.values()), id_patterns, read_window], sort_keys=True)
+    return hashlib.sha1(scanner_spec.encode()).hexdigest()
+
+
+# only read the .err files that aren't in the index yet or have changed since they were indexed
+def classify_indexed_err_paths(err_file_paths, error_strings, id_patterns, workers, err_index, read_window=None):
+    scanner_key = get_scanner_key(error_strings, id_patterns, read_window)
+    indexed = {row[0]: row[1:] for row in err_index.execute(
+        "SELECT path, mtime_ns, ctime_ns, size, error_string, ids, error_line FROM err_logs "
+        "WHERE scanner_key = ?", (scanner_key,)
+    )}
+
+    err_records = {}
+    stale_stats = {}
+    for err_file_path in err_file_paths:
+        stat = os.stat(err_file_path)
+        file_state = (stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size)
+        indexed_row = indexed.get(err_file_path)
+        if indexed_row and indexed_row[:3] == file_state:
+            record = {"Error_Log_Path": err_file_path, "Error_String": indexed_row[3],
+                      "Error_Line": indexed_row[5], "Error_Log_Mtime": indexed_row[0] / 1e9}
+            record.update(json.loads(indexed_row[4]))
+            err_records[err_file_path] = record
+        else:
+            stale_stats[err_file_path] = file_state
+    print(f"{len(err_records)} .err files found in the index, {len(stale_stats)} new or changed .err files to read.")
+
+    stale_records = classify_err_paths(list(stale_stats), error_strings, id_patterns, workers, read_window=read_window)
+    rows = []
+    for record in stale_records:
+        err_file_path = record["Error_Log_Path"]
+        err_records[err_file_path] = record
+        run_number = re.search(r"_(\d+)\.err$", os.path.basename(err_file_path))
+        ids = {key: record[key] for key in id_patterns}
+        rows.append((err_file_path, *stale_stats[err_file_path], scanner_key,
+                     run_number.group(1) if run_number else None, record["Error_String"],
+                     record.get("Subject_ID"), record.get("Session_ID"), json.dumps(ids), record["Error_Line"]))
+    with err_index:
+        err_index.executemany("INSERT OR REPLACE INTO err_logs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    return [err_records[err_file_path] for err_file_path in err_file_paths]
+
+
+# sort run numbers numerically so the output is the same from run to run
+def run_number_sort_key(run_number):
+    return (0, int(run_number), "") if str(run_number).isdigit() else (1, 0, str(run_number))
+
+
+# classify the most recent .err file for each run number
+def classify_err_files(most_recent_err_files, error_strings, id_patterns=id_patterns, workers=1, err_index=None, read_window=None):
+    run_numbers = sorted(most_recent_err_files, key=run_number_sort_key)
+    err_records = classify_err_paths([most_recent_err_files[run_number] for run_number in run_numbers],
+                                     error_strings, id_patterns, workers, err_index, read_window)
+    return dict(zip(run_numbers, err_records))
+
+
+# if using subject id list, find most recent err file
+def get_most_recent_err_files_from_id(output_logs_dir, sub_ids_csv, error_strings=error_strings, workers=1, err_index=None, read_window=None):
+    # Patterns to find subject and session IDs
     COLS_ID = ["subject", "session"]
-    err_files_df[COLS_ID] = err_files_df["err_file_path"].apply(
-        lambda fpath: get_sub_and_ses_IDs(fpath, find_subj, find_ses)
-    ).values.tolist()
+    find_ids = dict(id_patterns)
+    find_ids[COLS_ID[0]] = r"(sub-NDARINV.{8})"
+    find_ids[COLS_ID[1]] = r"(ses-.*Arm[0-9]{1})"
+
+    # Classify every error file in a single read, getting its error and its subject and session ID
+    err_file_ctimes = list_err_files(output_logs_dir)
+    err_records = classify_err_paths(sorted(err_file_ctimes), error_strings, find_ids, workers, err_index, read_window)
+    err_files_df = pd.DataFrame(err_records, columns=["Error_Log_Path", *COLS_ID])
+    err_files_df = err_files_df.rename(columns={"Error_Log_Path": "err_file_path"})
 
-    # Check how recently each error file was [created? updated?]
-    err_files_df["recency"] = err_files_df["err_file_path"].apply(os.path.getctime)
+    # Check how recently each error file was [created? updated?], reusing the ctimes from the directory listing
+    err_files_df["recency"] = err_files_df["err_file_path"].map(err_file_ctimes)
 
-    most_recent_err_files = remove_err_files_and_get_most_recent_v1(
+    most_recent_err_files = remove_err_files_and_get_most_recent_v2(
         sub_ids_csv, err_files_df, COLS_ID
     )
-    # most_recent_err_files = remove_err_files_and_get_most_recent_v2(sub_ids_csv, err_files_df)
+    # most_recent_err_files = remove_err_files_and_get_most_recent_v1(sub_ids_csv, err_files_df, COLS_ID)
+
+    # Reuse the records of the most recent error files instead of reading them again
+    records_by_path = {record["Error_Log_Path"]: record for record in err_records}
+    most_recent_err_records = {sub_id: records_by_path[err_file]
+                               for sub_id, err_file in most_recent_err_files.items()}
 
     # Get all error files that don't include a subject ID
     no_sub_id_err_files = err_files_df[err_files_df[COLS_ID[0]].isna()
                                        ]["err_file_path"].values.tolist()
     
-    return most_recent_err_files, no_sub_id_err_files
+    return most_recent_err_records, no_sub_id_err_files
 
 
 def remove_err_files_and_get_most_recent_v1(sub_ids_csv, err_files_df, COLS_ID):
@@ -203,44 +541,31 @@ def remove_err_files_and_get_most_recent_v1(sub_ids_csv, err_files_df, COLS_ID):
     return most_recent_err_files
 
 
-def remove_err_files_and_get_most_recent_v2(sub_ids_csv, err_files_df, COLS_ID=None):
-    csv_df = pd.read_csv(sub_ids_csv)
-    if not COLS_ID:
-        COLS_ID = csv_df.columns.values.tolist()
+def remove_err_files_and_get_most_recent_v2(sub_ids_csv, err_files_df, COLS_ID):
+    # Same result as v1, but matches the whole subject list against the error files in one merge
+    col_sub = COLS_ID[0]
+    csv_df = pd.read_csv(sub_ids_csv, header=None, names=COLS_ID, usecols=[0, 1], dtype=str).dropna()
     for col_name in COLS_ID:
-        csv_df[col_name] = f"{col_name[:3]}-" + csv_df[col_name]
-    intersection = err_files_df.merge(csv_df, how="inner", on=COLS_ID)
-    return intersection.groupby(COLS_ID).apply(
-        get_most_recent_err_file_and_remove_others
-    ).values.tolist()
-
+        csv_df[col_name] = f"{col_name[:3]}-" + csv_df[col_name].str.strip()
 
-def get_most_recent_err_file_and_remove_others(sub_ses_df: pd.DataFrame) -> str:
-    # Get the most recent error file and delete the rest
-    most_recent_err_file = None
-    if not sub_ses_df.empty:  
-        is_most_recent = (sub_ses_df["recency"] == sub_ses_df["recency"].max())
-        most_recent_row = sub_ses_df[is_most_recent].iloc[0]
-        sub_ses_df[~is_most_recent]["err_file_path"].apply(remove_err_and_log_files)
-        most_recent_err_file = most_recent_row.get("err_file_path")
-    return most_recent_err_file
+    # Get all error files for every subject and session in the .csv, keeping the order of err_files_df
+    intersection = err_files_df.merge(csv_df.drop_duplicates(), how="inner", on=COLS_ID)
+    if intersection.empty:
+        return dict()
 
+    # Like v1, only delete the error files older than the most recent one for their subject and session,
+    # so files tied with it are kept
+    by_sub_ses = intersection.groupby(COLS_ID, sort=False)["recency"]
+    is_older = intersection["recency"] < by_sub_ses.transform("max")
+    remove_err_and_log_files_batch(intersection.loc[is_older, "err_file_path"].tolist())
 
-def get_sub_and_ses_IDs(err_file_path: str, find_subj, find_ses):
-    # Get subject and session IDs from the content of an error file, and if
-    # one is missing, return that one as None instead
-    with open(err_file_path, 'r') as file:
-        file_content = file.read()
-    return [get_sub_or_ses_ID_in(find_subj, file_content),
-            get_sub_or_ses_ID_in(find_ses, file_content)]
+    # Return the first of the most recent error files for each subject and session (idxmax keeps the first one on ties, like v1's iloc[0])
+    most_recent_index = by_sub_ses.idxmax()
 
-
-def get_sub_or_ses_ID_in(pattern, str_to_find_ID_in):
-    # Get the subject- or session-ID from a string by using the Regex pattern
-    matched_ID = re.search(pattern, str_to_find_ID_in)
-    if matched_ID:
-        matched_ID = matched_ID.group()
-    return matched_ID
+    # Walk the .csv lines in order so, like v1, a subject listed twice keeps its first position but its last session
+    most_recent_rows = csv_df.merge(intersection.loc[most_recent_index.values, [*COLS_ID, "err_file_path"]],
+                                    how="inner", on=COLS_ID)
+    return dict(zip(most_recent_rows[col_sub], most_recent_rows["err_file_path"]))
 
 
 def remove_err_and_log_files(err_file_path):
@@ -250,20 +575,34 @@ def remove_err_and_log_files(err_file_path):
             os.remove(each_log_file)
 
 
+def remove_err_and_log_files_batch(err_file_paths):
+    # Delete every .err file (and its .out file) in one go rather than one DataFrame row at a time
+    removed = []
+    for err_file_path in err_file_paths:
+        for each_log_file in (err_file_path, err_file_path.replace(".err", ".out")):
+            try:
+                os.remove(each_log_file)
+                removed.append(each_log_file)
+            except FileNotFoundError:
+                pass
+    if removed:
+        print("\n".join(removed))
+
+
 # if using subject id list, find most recent err file
 def get_most_recent_err_files_from_id_old(output_logs_dir, sub_ids_csv):
     most_recent_err_files = {}
     no_sub_id_err_files = [] 
     err_files = glob(os.path.join(output_logs_dir, f"*.err"))
     for err_file in err_files:
-        with open(err_file, 'r') as file:
-            file_content = file.read()
-        with open(sub_ids_csv, 'r') as csv_file:
+        # search the mapped bytes of the file rather than reading it all into a string (an empty file can't be mapped)
+        with open(err_file, 'rb') as file, open(sub_ids_csv, 'r') as csv_file, \
+                (mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(file.fileno()).st_size else nullcontext(b"")) as file_content:
             sub_id_found=False
             for line in csv_file:
                 sub_id,ses_id = line.strip().split(",")
-                sub_match = re.search(sub_id, file_content)
-                ses_match = re.search(ses_id, file_content)
+                sub_match = re.search(sub_id.encode(), file_content)
+                ses_match = re.search(ses_id.encode(), file_content)
                 if sub_match and ses_match:
                     sub_id_found=True
                     if sub_id not in most_recent_err_files or os.path.getctime(err_file) > os.path.getctime(most_recent_err_files[sub_id]):
@@ -283,124 +622,113 @@ def get_most_recent_err_files_from_id_old(output_logs_dir, sub_ids_csv):
     
     return most_recent_err_files, no_sub_id_err_files
 
-# read error files and look for specific error strings
-def find_errors(error_strings, most_recent_err_files):
+# sort the classified error files by the error string found in each
+def find_errors(error_strings, err_records):
     error_strings_list = list(error_strings.values())
     
     errors_by_string = {error_string: [] for error_string in error_strings_list} 
     run_numbers_with_error = set()
     run_numbers_without_error = set()
     
-    for run_number, err_file in most_recent_err_files.items():
-        with open(err_file, 'r') as err_file:
-            content = err_file.read()
-            # hard coded to catch for undetermined errors 
-            # TODO: separate non error list and error string list
-            for error_string in error_strings_list[1:]:
-                if error_string in content:
-                    errors_by_string[error_string].append(run_number)
-                    run_numbers_with_error.add(run_number)
-                    break
-            for error_string in error_strings_list[:1]:
-                if run_number not in run_numbers_with_error:
-                    errors_by_string[error_string].append(run_number)
-                    run_numbers_without_error.add(run_number)
+    for run_number, record in err_records.items():
+        errors_by_string[record["Error_String"]].append(run_number)
+        # hard coded to catch for undetermined errors 
+        # TODO: separate non error list and error string list
+        if record["Error_String"] == error_strings_list[0]:
+            run_numbers_without_error.add(run_number)
+        else:
+            run_numbers_with_error.add(run_number)
     
     return errors_by_string, run_numbers_with_error, run_numbers_without_error
 
-# find subject_id and session_id for each run number within the associated error file
-# TODO: for loop in code is being repeated, need to consolidate 
-# STEPS: make code within for loops its own function, call that new function within find_subject_session_ids
-def find_subject_session_ids(run_files_dir, run_numbers_with_error, run_numbers_without_error, most_recent_err_files):
-    error_data = {
-        "Run_Number": [],
-        "Error_Log_Paths": [],
-        "Subject_IDs": [],
-        "Session_IDs": []
-    }
-
-    for run_number in run_numbers_with_error:
-        with open(most_recent_err_files[run_number], 'r') as err_file:
-            err_content = err_file.read()
-            sub_match = re.search(r"sub-([a-zA-Z0-9_]+)", err_content)
-            ses_match = re.search(r"ses-([a-zA-Z0-9_]+)", err_content)
-            if sub_match and ses_match:
-                subject_id = sub_match.group(1)
-                session_id = ses_match.group(1)
-                inputs = [run_number, most_recent_err_files[run_number], subject_id, session_id]
-                for key, value in zip(error_data.keys(), inputs):
-                    error_data[key].append(value)
-            elif not run_files_dir == "": 
-                # if subject_id and session_id not found, extract info from the associated run file in the run_files directory 
-                run_file = os.path.join(run_files_dir, f"run{run_number}")
-                if os.path.exists(run_file):
-                    with open(run_file, 'r') as run_file:
-                        lines = run_file.readlines()
-                        subject_id = None
-                        session_id = None
-                        for line in lines:
-                            if "subject_id" in line:
-                                subject_id = re.search(r"subject_id=(\w+)", line)
-                                if subject_id:
-                                    subject_id = subject_id.group(1)
-                            elif "ses_id" in line:
-                                session_id = re.search(r"ses_id=(\w+)", line)
-                                if session_id:
-                                    session_id = session_id.group(1)
-                            if subject_id and session_id:
-                                break
-                        if subject_id and session_id:
-                            inputs = [run_number, most_recent_err_files[run_number], subject_id, session_id]
-                            for key, value in zip(error_data.keys(), inputs):
-                                error_data[key].append(value)
-            else:
-                subject_id = None
-                session_id = None
-                inputs = [run_number, most_recent_err_files[run_number], subject_id, session_id]
-                for key, value in zip(error_data.keys(), inputs):
-                    error_data[key].append(value)
-
-    for run_number in run_numbers_without_error:
-        with open(most_recent_err_files[run_number], 'r') as err_file:
-            err_content = err_file.read()
-            sub_match = re.search(r"sub-([a-zA-Z0-9_]+)", err_content)
-            ses_match = re.search(r"ses-([a-zA-Z0-9_]+)", err_content)
-            if sub_match and ses_match:
-                subject_id = sub_match.group(1)
-                session_id = ses_match.group(1)
-                inputs = [run_number, most_recent_err_files[run_number], subject_id, session_id]
-                for key, value in zip(error_data.keys(), inputs):
-                    error_data[key].append(value)
-            elif not run_files_dir == "": 
-                # if subject_id and session_id not found, extract info from the associated run file in the run_files directory 
-                run_file = os.path.join(run_files_dir, f"run{run_number}")
-                if os.path.exists(run_file):
-                    with open(run_file, 'r') as run_file:
-                        lines = run_file.readlines()
-                        subject_id = None
-                        session_id = None
-                        for line in lines:
-                            if "subject_id" in line:
-                                subject_id = re.search(r"subject_id=(\w+)", line)
-                                if subject_id:
-                                    subject_id = subject_id.group(1)
-                            elif "ses_id" in line:
-                                session_id = re.search(r"ses_id=(\w+)", line)
-                                if session_id:
-                                    session_id = session_id.group(1)
-                            if subject_id and session_id:
-                                break
-                        if subject_id and session_id:
-                            inputs = [run_number, most_recent_err_files[run_number], subject_id, session_id]
-                            for key, value in zip(error_data.keys(), inputs):
-                                error_data[key].append(value)
-            else:
+# extract the subject_id and session_id from a run file
+def parse_run_file(run_file_path):
+    subject_id = None
+    session_id = None
+    with open(run_file_path, 'r') as run_file:
+        for line in run_file:
+            if "subject_id" in line:
+                subject_id = re.search(r"subject_id=(\w+)", line)
+                if subject_id:
+                    subject_id = subject_id.group(1)
+            elif "ses_id" in line:
+                session_id = re.search(r"ses_id=(\w+)", line)
+                if session_id:
+                    session_id = session_id.group(1)
+            if subject_id and session_id:
+                break
+    return subject_id, session_id
+
+# run files are named run<run number>, anything else in the run_files directory is skipped
+run_file_pattern = re.compile(r"run(\d+)")
+
+# parse every run file in the run_files directory once into a run number -> (subject_id, session_id) map;
+# with an index, run files that haven't been modified since the last run aren't read again
+def load_run_file_ids(run_files_dir, err_index=None):
+    cached = {}
+    if err_index is not None:
+        cached = {row[0]: row[1:] for row in err_index.execute(
+            "SELECT path, mtime_ns, subject_id, session_id FROM run_files"
+        )}
+    run_file_ids = {}
+    rows = []
+    with os.scandir(run_files_dir) as entries:
+        for entry in entries:
+            run_file_name = run_file_pattern.fullmatch(entry.name)
+            if run_file_name and entry.is_file():
+                mtime_ns = entry.stat().st_mtime_ns
+                cached_row = cached.get(entry.path)
+                if cached_row and cached_row[0] == mtime_ns:
+                    ids = cached_row[1:]
+                else:
+                    ids = parse_run_file(entry.path)
+                    rows.append((entry.path, mtime_ns, *ids))
+                run_file_ids[run_file_name.group(1)] = tuple(ids)
+    if err_index is not None and rows:
+        with err_index:
+            err_index.executemany("INSERT OR REPLACE INTO run_files VALUES (?, ?, ?, ?)", rows)
+    return run_file_ids
+
+# parse the run file of a single run number, as (None, None) if it doesn't have one
+def get_run_file_ids(run_files_dir, run_number):
+    run_file_path = os.path.join(run_files_dir, f"run{run_number}")
+    if not os.path.isfile(run_file_path):
+        return None, None
+    return parse_run_file(run_file_path)
+
+# find subject_id and session_id for each run number from its classified error file,
+# returning a dictionary of each run number's error data keyed by the run number
+def find_subject_session_ids(run_files_dir, run_numbers_with_error, run_numbers_without_error, err_records, err_index=None):
+    error_data = {}
+    # with an index, every run file's IDs are loaded (and cached) the first time an .err file is missing its IDs;
+    # without one, only the run files of those .err files are read
+    run_file_ids = None
+
+    for run_numbers in (run_numbers_with_error, run_numbers_without_error):
+        # follow the order of err_records rather than the set so the csv rows come out in a fixed order
+        for run_number in (run_number for run_number in err_records if run_number in run_numbers):
+            record = err_records[run_number]
+            subject_id = record["Subject_ID"]
+            session_id = record["Session_ID"]
+            if not (subject_id and session_id) and not run_files_dir == "":
+                # if subject_id and session_id not found in the .err file, look them up from the associated run file in the run_files directory
+                if err_index is None:
+                    subject_id, session_id = get_run_file_ids(run_files_dir, run_number)
+                else:
+                    if run_file_ids is None:
+                        run_file_ids = load_run_file_ids(run_files_dir, err_index)
+                    subject_id, session_id = run_file_ids.get(str(run_number), (None, None))
+                # runs without a usable run file are left out and reported as unmatchable
+                if not (subject_id and session_id):
+                    continue
+            elif not (subject_id and session_id):
                 subject_id = None
                 session_id = None
-                inputs = [run_number, most_recent_err_files[run_number], subject_id, session_id]
-                for key, value in zip(error_data.keys(), inputs):
-                    error_data[key].append(value)
-
+            error_data.setdefault(run_number, {
+                'Error_Log_Path': record["Error_Log_Path"],
+                'Subject_ID': subject_id,
+                'Session_ID': session_id
+            })
     
     return error_data
 
@@ -410,32 +738,12 @@ def match_error_data(error_data, errors_by_string):
 
     for string, run_numbers in errors_by_string.items():
         for run_number in run_numbers:
-            try:
-                if run_number in error_data['Run_Number'] and string not in matched_error_data:
-                    run_index = error_data['Run_Number'].index(run_number)
-                    error_data_dict = {
-                        'Error_Log_Path': error_data['Error_Log_Paths'][run_index],
-                        'Subject_ID': error_data['Subject_IDs'][run_index],
-                        'Session_ID': error_data['Session_IDs'][run_index]
-                    }
-                    matched_error_data[string] = [error_data_dict]
-                else:   
-                    run_index = error_data['Run_Number'].index(run_number)
-                    error_data_dict = {
-                        'Error_Log_Path': error_data['Error_Log_Paths'][run_index],
-                        'Subject_ID': error_data['Subject_IDs'][run_index],
-                        'Session_ID': error_data['Session_IDs'][run_index]
-                    } 
-                    matched_error_data[string].append(error_data_dict)
-            # TODO: further edit this exception
-            except ValueError as e:
-                if "is not in list" in str(e):
-                    print("Unmatchable error logs! run file may be missing from the run_files dir")
-                    pass
-                #elif e:
-                #    pass
-                else:
-                    raise
+            # error_data is keyed by run number, so each run is a single lookup
+            error_data_dict = error_data.get(run_number)
+            if error_data_dict is None:
+                print("Unmatchable error logs! run file may be missing from the run_files dir")
+                continue
+            matched_error_data.setdefault(string, []).append(error_data_dict)
 
     return matched_error_data
 
@@ -464,6 +772,10 @@ def match_and_print_errors(no_sub_id_err_files,matched_error_data, error_strings
                 writer.writerow(error_data)            
         print(f"CSV file '{csv_filename}' created with {len(error_data_list)} entries.")
 
+    write_no_sub_id_csv(no_sub_id_err_files, output_dir)
+
+# list the .err files that are missing subject and session information
+def write_no_sub_id_csv(no_sub_id_err_files, output_dir):
     no_sub_id_csv = os.path.join(output_dir, f"no_sub_id_errors.csv")
     with open (no_sub_id_csv, 'w', newline='') as csvfile:
         fieldnames = ['paths']
@@ -473,5 +785,34 @@ def match_and_print_errors(no_sub_id_err_files,matched_error_data, error_strings
             writer.writerow({'paths': line})
     print(f"CSV file '{no_sub_id_csv}' created with {len(no_sub_id_err_files)} entries.")
 
+# write one tidy table with a row for each run, its error and the line it was found on
+def write_combined_results(err_records, error_data, error_strings, output_dir, output_format):
+    error_names = {error_value: error_name for error_name, error_value in reversed(list(error_strings.items()))}
+    rows = []
+    for run_number, data in error_data.items():
+        record = err_records[run_number]
+        # records from a subject list are keyed by subject, so take the run number from the log's name
+        log_run_number = re.search(r"_(\d+)\.err", os.path.basename(record["Error_Log_Path"]))
+        rows.append({
+            "Run_Number": log_run_number.group(1) if log_run_number else str(run_number),
+            "Error_Log_Path": data["Error_Log_Path"],
+            "Subject_ID": data["Subject_ID"],
+            "Session_ID": data["Session_ID"],
+            "Error_Name": error_names.get(record["Error_String"], record["Error_String"]),
+            "Error_Line": record.get("Error_Line"),
+            "Error_Log_Mtime": record.get("Error_Log_Mtime")
+        })
+    results_df = pd.DataFrame(rows, columns=["Run_Number", "Error_Log_Path", "Subject_ID", "Session_ID",
+                                             "Error_Name", "Error_Line", "Error_Log_Mtime"])
+    results_df["Error_Log_Mtime"] = pd.to_datetime(results_df["Error_Log_Mtime"], unit="s")
+    results_file = os.path.join(output_dir, f"error_query_results.{output_format}")
+    if output_format == "csv":
+        results_df.to_csv(results_file, index=False)
+    elif output_format == "parquet":
+        results_df.to_parquet(results_file, index=False)
+    else:
+        results_df.to_feather(results_file)
+    print(f"Results file '{results_file}' created with {len(results_df)} entries.")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,208 @@
+"""
+Purpose: Loads a fasttrack into a pandas table once, with explicit column types (every text column as a category),
+and caches a Parquet copy next to it that is reused until the fasttrack changes. Filters and counts are then
+vectorized over the memory-mapped Parquet copy instead of re-reading the NDA text a line at a time.
+Needs pandas and pyarrow. filter_fasttrack.py does the same filters in one streamed pass without them.
+"""
+import argparse
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from filter_fasttrack import normalize_subjectkey, read_header, read_subjectkeys
+
+# Columns read as numbers, every other column is read as a category (strings stored once, each row an index)
+integer_columns = {"ftq_usable": pa.int8(), "interview_age": pa.int16()}
+category_type = pa.dictionary(pa.int32(), pa.string())
+# to_pandas turns an integer column with any empty cells into floats (0.0/1.0), so they're read as nullable integers instead
+pandas_integer_types = {pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype()}
+# Parquet metadata keys for the fasttrack the cache was made from
+cache_source_keys = (b"source_mtime_ns", b"source_size")
+
+
+def _cli():
+    """
+    :return: Dictionary with all validated command-line arguments from the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--fasttrack', required=True,
+        help='Path to the fasttrack file (e.g. abcd_fasttrack.txt). A Parquet copy is cached next to it as <name>.parquet'
+    )
+    parser.add_argument(
+        '--refresh', action="store_true",
+        help='Re-read the fasttrack even if the cached Parquet copy is up to date'
+    )
+    parser.add_argument(
+        '--subject-list', dest="subject_list",
+        help='Path to a file of subject IDs to keep, one per line, with or without the "sub-" prefix or _. Used with --subject-output'
+    )
+    parser.add_argument(
+        '--subject-output', dest="subject_output",
+        help='Path to write the rows of the subjects in --subject-list to'
+    )
+    parser.add_argument(
+        '--remove-word', dest="remove_word",
+        help='Word to filter out, e.g. Replaced. Used with --remove-word-output'
+    )
+    parser.add_argument(
+        '--remove-word-output', dest="remove_word_output",
+        help='Path to write the rows where no column contains --remove-word to'
+    )
+    parser.add_argument(
+        '--bad-data-output', dest="bad_data_output",
+        help='Path to write the rows with bad data (ftq_usable==0) to'
+    )
+    parser.add_argument(
+        '--subject-ids-output', dest="subject_ids_output",
+        help='Path to write each subject ID in the fasttrack to, once each (removing _ from the subject key)'
+    )
+    parser.add_argument(
+        '--count-by', dest="count_by", nargs='+',
+        help='Columns to count rows, usable rows and bad rows by, e.g. "subjectkey" for usable series per subject '
+             'or "subjectkey visit" for bad data per session. Used with --counts-output'
+    )
+    parser.add_argument(
+        '--counts-output', dest="counts_output",
+        help='Path to write the --count-by counts to'
+    )
+    parser.add_argument(
+        '--subject-column', dest="subject_column", default="subjectkey",
+        help='Name of the column with the subject IDs in the fasttrack header. Default is subjectkey'
+    )
+    parser.add_argument(
+        '--usable-column', dest="usable_column", default="ftq_usable",
+        help='Name of the column that is 0 for bad data in the fasttrack header. Default is ftq_usable'
+    )
+    cli_args = vars(parser.parse_args())
+    for option, output in (("subject_list", "subject_output"), ("remove_word", "remove_word_output"), ("count_by", "counts_output")):
+        if bool(cli_args[option]) != bool(cli_args[output]):
+            parser.error(f"--{option.replace('_', '-')} and --{output.replace('_', '-')} need to be given together")
+    return cli_args
+
+
+def get_cache_path(fasttrack_file):
+    return f"{os.path.splitext(fasttrack_file)[0]}.parquet"
+
+
+def cache_is_current(cache_file, fasttrack_stat):
+    """True if cache_file was made from a fasttrack with the same mtime and size"""
+    if not os.path.exists(cache_file):
+        return False
+    metadata = pq.read_schema(cache_file).metadata or {}
+    return [metadata.get(key) for key in cache_source_keys] == [str(fasttrack_stat.st_mtime_ns).encode(), str(fasttrack_stat.st_size).encode()]
+
+
+def parse_fasttrack(fasttrack_file, subject_column="subjectkey"):
+    """
+    Reads a tab separated fasttrack into an Arrow table in one pass, skipping NDA's column description line,
+    with integer_columns as numbers and every other column as a category
+    """
+    with open(fasttrack_file, 'r') as in_file:
+        header_lines, column_index = read_header(in_file, subject_column)
+    column_types = {name: integer_columns.get(name, category_type) for name in column_index}
+    return pa_csv.read_csv(
+        fasttrack_file,
+        read_options=pa_csv.ReadOptions(skip_rows_after_names=len(header_lines) - 1),
+        parse_options=pa_csv.ParseOptions(delimiter="\t"),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+    )
+
+
+def write_cache(table, cache_file, fasttrack_stat):
+    """Writes table to cache_file with the fasttrack's mtime and size, replacing any older copy"""
+    source_metadata = dict(zip(cache_source_keys, (str(fasttrack_stat.st_mtime_ns).encode(), str(fasttrack_stat.st_size).encode())))
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), **source_metadata})
+    temp_file = f"{cache_file}.new"
+    pq.write_table(table, temp_file)
+    os.replace(temp_file, cache_file)
+
+
+def load_fasttrack(fasttrack_file, subject_column="subjectkey", refresh=False):
+    """
+    Returns the fasttrack as a DataFrame, from the cached Parquet copy if it's up to date,
+    otherwise parsing the fasttrack and caching it (if its folder can be written to)
+    """
+    fasttrack_stat = os.stat(fasttrack_file)
+    cache_file = get_cache_path(fasttrack_file)
+    if not refresh and cache_is_current(cache_file, fasttrack_stat):
+        print(f"Using cached {cache_file}")
+        return pq.read_table(cache_file, memory_map=True).to_pandas(types_mapper=pandas_integer_types.get)
+    table = parse_fasttrack(fasttrack_file, subject_column)
+    try:
+        write_cache(table, cache_file, fasttrack_stat)
+        print(f"Cached {fasttrack_file} to {cache_file}")
+    except OSError as error:
+        print(f"Could not cache {fasttrack_file} to {cache_file}: {error}")
+    return table.to_pandas(types_mapper=pandas_integer_types.get)
+
+
+def normalized_subjectkeys(fasttrack_df, subject_column="subjectkey"):
+    """The subject column without sub- or _. A category column is only normalized once per distinct subject"""
+    return fasttrack_df[subject_column].map(normalize_subjectkey, na_action="ignore")
+
+
+def subject_rows(fasttrack_df, allowed_subjectkeys, subject_column="subjectkey"):
+    allowed_subjectkeys = {normalize_subjectkey(subjectkey) for subjectkey in allowed_subjectkeys}
+    return fasttrack_df[normalized_subjectkeys(fasttrack_df, subject_column).isin(allowed_subjectkeys)]
+
+
+def rows_without_word(fasttrack_df, word_to_remove):
+    has_word = pd.Series(False, index=fasttrack_df.index)
+    for column in fasttrack_df.columns:
+        values = fasttrack_df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # check each distinct value once, then look the rows up by their category code
+            has_word |= values.cat.codes.isin(values.cat.categories.str.contains(word_to_remove, regex=False).nonzero()[0])
+        elif pd.api.types.is_string_dtype(values):
+            has_word |= values.astype(str).str.contains(word_to_remove, regex=False)
+    return fasttrack_df[~has_word]
+
+
+def bad_data_rows(fasttrack_df, usable_column="ftq_usable"):
+    return fasttrack_df[fasttrack_df[usable_column] == 0]
+
+
+def subject_ids(fasttrack_df, subject_column="subjectkey"):
+    """Each subject ID in the fasttrack, once each, in the order they first appear"""
+    subjectkeys = normalized_subjectkeys(fasttrack_df, subject_column).dropna().astype(str)
+    return subjectkeys[subjectkeys != ""].unique()
+
+
+def count_rows(fasttrack_df, count_by, usable_column="ftq_usable"):
+    """Number of rows, usable rows and bad rows for each combination of the count_by columns"""
+    usable = fasttrack_df[usable_column]
+    # rows with an empty ftq_usable are counted, but as neither usable nor bad
+    return fasttrack_df.assign(rows=1, usable_rows=(usable == 1).fillna(False).astype(int), bad_rows=(usable == 0).fillna(False).astype(int)) \
+        .groupby(count_by, observed=True)[["rows", "usable_rows", "bad_rows"]].sum().reset_index()
+
+
+def write_rows(rows_df, output_file):
+    rows_df.to_csv(output_file, sep="\t", index=False)
+    print(f"Filtered content written to '{output_file}'.")
+
+
+def main():
+    cli_args = _cli()
+    subject_column = cli_args["subject_column"]
+    usable_column = cli_args["usable_column"]
+    fasttrack_df = load_fasttrack(cli_args["fasttrack"], subject_column, cli_args["refresh"])
+    if cli_args["subject_output"]:
+        write_rows(subject_rows(fasttrack_df, read_subjectkeys(cli_args["subject_list"]), subject_column), cli_args["subject_output"])
+    if cli_args["remove_word_output"]:
+        write_rows(rows_without_word(fasttrack_df, cli_args["remove_word"]), cli_args["remove_word_output"])
+    if cli_args["bad_data_output"]:
+        write_rows(bad_data_rows(fasttrack_df, usable_column), cli_args["bad_data_output"])
+    if cli_args["subject_ids_output"]:
+        with open(cli_args["subject_ids_output"], 'w') as output:
+            output.writelines(f"{subjectkey}\n" for subjectkey in subject_ids(fasttrack_df, subject_column))
+        print(f"Filtered content written to '{cli_args['subject_ids_output']}'.")
+    if cli_args["counts_output"]:
+        write_rows(count_rows(fasttrack_df, cli_args["count_by"], usable_column), cli_args["counts_output"])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,91 +1,205 @@
-import csv
-import re
+import argparse
+from contextlib import ExitStack
 
 """
 Author: rae McCollum
 Created: 5 Dec 2023
 Purpose: Filter fasttrack to only include certain subject IDs, lines without a specific word, or lines that have bad data (ftq_usable==0). Can also produce a list of subject IDs present in a fasttrack.
+Any number of these outputs are written in one read of the fasttrack, a line at a time. Columns are found by their names in the header.
 Last Modified: 26 Feb 2024
 """
 
 
+def _cli():
+    """
+    :return: Dictionary with all validated command-line arguments from the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--fasttrack', required=True,
+        help='Path to the fasttrack file (e.g. abcd_fasttrack.txt)'
+    )
+    parser.add_argument(
+        '--subject-list', dest="subject_list",
+        help='Path to a file of subject IDs to keep, one per line, with or without the "sub-" prefix or _. Used with --subject-output'
+    )
+    parser.add_argument(
+        '--subject-output', dest="subject_output",
+        help='Path to write the fasttrack lines of the subjects in --subject-list to'
+    )
+    parser.add_argument(
+        '--remove-word', dest="remove_word",
+        help='Word to filter out, e.g. Replaced. Used with --remove-word-output'
+    )
+    parser.add_argument(
+        '--remove-word-output', dest="remove_word_output",
+        help='Path to write the fasttrack lines that do not contain --remove-word to'
+    )
+    parser.add_argument(
+        '--bad-data-output', dest="bad_data_output",
+        help='Path to write the fasttrack lines with bad data (ftq_usable==0) to'
+    )
+    parser.add_argument(
+        '--subject-ids-output', dest="subject_ids_output",
+        help='Path to write each subject ID in the fasttrack to, once each (removing _ from the subject key)'
+    )
+    parser.add_argument(
+        '--subject-column', dest="subject_column", default="subjectkey",
+        help='Name of the column with the subject IDs in the fasttrack header. Default is subjectkey'
+    )
+    parser.add_argument(
+        '--usable-column', dest="usable_column", default="ftq_usable",
+        help='Name of the column that is 0 for bad data in the fasttrack header. Default is ftq_usable'
+    )
+    cli_args = vars(parser.parse_args())
+    if bool(cli_args["subject_list"]) != bool(cli_args["subject_output"]):
+        parser.error("--subject-list and --subject-output need to be given together")
+    if bool(cli_args["remove_word"]) != bool(cli_args["remove_word_output"]):
+        parser.error("--remove-word and --remove-word-output need to be given together")
+    if not any(cli_args[output] for output in ("subject_output", "remove_word_output", "bad_data_output", "subject_ids_output")):
+        parser.error("at least one of --subject-output, --remove-word-output, --bad-data-output or --subject-ids-output is needed")
+    return cli_args
+
+
+def normalize_subjectkey(subjectkey):
+    """Subject ID without quotes, a sub- prefix or _, so "NDAR_INVXXXXXXXX", sub-NDARINVXXXXXXXX and NDARINVXXXXXXXX match"""
+    subjectkey = subjectkey.strip().strip('"').strip()
+    if subjectkey.startswith("sub-"):
+        subjectkey = subjectkey[len("sub-"):]
+    return subjectkey.replace("_", "")
+
+
+def get_value(columns, index):
+    """Value of a split fasttrack line's column without quotes, or None if the line is too short"""
+    return columns[index].strip().strip('"') if index < len(columns) else None
+
+
+def subject_ids_route(output_file, subject_column="subjectkey"):
+    """Route that writes each subject ID the first time it's seen"""
+    def bind(column_index):
+        subject_index = column_index[subject_column]
+        seen_subjectkeys = set()
+        def route(line, columns):
+            if subject_index < len(columns):
+                subjectkey = normalize_subjectkey(columns[subject_index])
+                if subjectkey and subjectkey not in seen_subjectkeys:
+                    seen_subjectkeys.add(subjectkey)
+                    return f"{subjectkey}\n"
+            return None
+        return route
+    return {"output_file": output_file, "columns": [subject_column], "bind": bind, "keep_header": False}
+
+
+def subject_route(output_file, allowed_subjectkeys, subject_column="subjectkey"):
+    """Route that writes the lines of the allowed subjects"""
+    allowed_subjectkeys = {normalize_subjectkey(subjectkey) for subjectkey in allowed_subjectkeys}
+    def bind(column_index):
+        subject_index = column_index[subject_column]
+        def route(line, columns):
+            if subject_index < len(columns) and normalize_subjectkey(columns[subject_index]) in allowed_subjectkeys:
+                return line
+            return None
+        return route
+    return {"output_file": output_file, "columns": [subject_column], "bind": bind, "keep_header": True}
+
+
+def remove_word_route(output_file, word_to_remove):
+    """Route that writes the lines without word_to_remove"""
+    def bind(column_index):
+        return lambda line, columns: line if word_to_remove not in line else None
+    return {"output_file": output_file, "columns": [], "bind": bind, "keep_header": True}
+
+
+def bad_data_route(output_file, usable_column="ftq_usable"):
+    """Route that writes the lines where ftq_usable is 0"""
+    def bind(column_index):
+        usable_index = column_index[usable_column]
+        return lambda line, columns: line if get_value(columns, usable_index) == "0" else None
+    return {"output_file": output_file, "columns": [usable_column], "bind": bind, "keep_header": True}
+
+
+def read_subjectkeys(allowed_subjectkeys_file):
+    """Subject IDs in a file, one per line"""
+    with open(allowed_subjectkeys_file, 'r') as allowed_file:
+        return [line.strip() for line in allowed_file if line.strip()]
+
+
+def read_header(in_file, subject_column="subjectkey"):
+    """
+    Reads the header lines of an open fasttrack and returns them with {column name: index}.
+    NDA files have a second header line of column descriptions, which is told apart from
+    the first data line by the spaces in its subject column (subject IDs have none)
+    """
+    header_lines = [in_file.readline()]
+    column_names = [name.strip().strip('"') for name in header_lines[0].rstrip("\r\n").split('\t')]
+    column_index = {name: index for index, name in reversed(list(enumerate(column_names)))}
+    if subject_column in column_index:
+        position = in_file.tell()
+        next_line = in_file.readline()
+        description = get_value(next_line.rstrip("\r\n").split('\t'), column_index[subject_column])
+        if description and len(description.split()) > 1:
+            header_lines.append(next_line)
+        else:
+            in_file.seek(position)
+    return header_lines, column_index
+
+
+def run_routes(input_file, routes, subject_column="subjectkey"):
+    """
+    Reads input_file once, finding the columns each route needs by name in the header, splitting
+    each line into its tab separated columns once, and writes whatever each route returns for
+    the line to that route's output file. Routes that write fasttrack lines get the header lines too
+    """
+    with open(input_file, 'r') as in_file, ExitStack() as open_outputs:
+        header_lines, column_index = read_header(in_file, subject_column)
+        missing_columns = sorted({column for route in routes for column in route["columns"] if column not in column_index})
+        if missing_columns:
+            raise ValueError(f"{input_file} has no {', '.join(missing_columns)} column in its header")
+        row_routes = [route["bind"](column_index) for route in routes]
+        output_files = [open_outputs.enter_context(open(route["output_file"], 'w')) for route in routes]
+        for route, output_file in zip(routes, output_files):
+            if route["keep_header"]:
+                output_file.writelines(header_lines)
+        for line in in_file:
+            columns = line.rstrip("\r\n").split('\t')
+            for row_route, output_file in zip(row_routes, output_files):
+                routed_line = row_route(line, columns)
+                if routed_line is not None:
+                    output_file.write(routed_line)
+    for route in routes:
+        print(f"Filtered content written to '{route['output_file']}'.")
+
+
 def grab_subject_ids(file_path, output_file):
     """Create list of all subject IDs (removing _ from subject row)"""
-    subjectkey_list = []
-
-    with open(file_path, 'r') as in_file:
-        reader = csv.reader(in_file, delimiter='\t')
-        for row in reader:
-            if len(row) >= 4:
-                subjectkey = row[3].replace("_", "")
-                subjectkey_list.append(subjectkey)
-            else:
-                print(f"Warning: Skipping row {row} as it doesn't have enough columns.")
-    with open(output_file, 'w') as output_file:
-        for sub in sub_list:
-            output_file.write(f"{sub}\n")
+    run_routes(file_path, [subject_ids_route(output_file)])
 
 def filter_by_subject(input_file, output_file, allowed_subjectkeys_file):
     try:
-        # Read allowed subjectkeys from the file
-        with open(allowed_subjectkeys_file, 'r') as allowed_file:
-            allowed_subjectkeys = [line.strip() for line in allowed_file.readlines()]
-
-        with open(input_file, 'r') as file:
-            lines = file.readlines()
-
-        # Process each line
-        filtered_lines = []
-        for line in lines:
-            # Split the line by tabs and extract the subjectkey
-            columns = line.strip().split('\t')
-            if len(columns) > 4:
-                subjectkey = columns[3].replace("_", "")
-                subjectkey = subjectkey.replace('"', "")  # Assuming "subjectkey" is in the second column (index 1)
-                
-                # Check if the subjectkey is in the allowed_subjectkeys list
-                if subjectkey in allowed_subjectkeys:
-                    filtered_lines.append(line)
-
-        with open(output_file, 'w') as output_file:
-            output_file.writelines(filtered_lines)
-
-        print(f"Filtered content written to '{output_file}'.")
+        run_routes(input_file, [subject_route(output_file, read_subjectkeys(allowed_subjectkeys_file))])
     except FileNotFoundError:
         print(f"Error: File not found at '{input_file}' or '{allowed_subjectkeys_file}'")
 
 def remove_lines_with_word(input_file, output_file, word_to_remove):
-    with open(input_file, 'r') as file:
-        lines = file.readlines()
-
-    # Filter out lines containing the specified word
-    filtered_lines = [line for line in lines if word_to_remove not in line]
+    run_routes(input_file, [remove_word_route(output_file, word_to_remove)])
 
-    with open(output_file, 'w') as file:
-        file.writelines(filtered_lines)
-        
 def grab_bad_data(input_file, output_file):
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-        for line in infile:
-            # Split the line into columns using tabs
-            columns = line.strip().split('\t')
-            
-            # Check if the 19th column (index 18) has a value of "0"
-            ftp_usable = columns[18]
-            if len(columns) >= 19 and columns[18] == '"0"':
-                # If yes, write the line to the output file
-                outfile.write(line)
+    run_routes(input_file, [bad_data_route(output_file)])
 
-if __name__ == "__main__":
-    fasttrack_path = "/path/to/abcd_fasttrack.txt"
-    subject_file = "/path/to/subject_list.txt"  # Needs to be a file that only has the subjectID without the "sub-" prefix
-    output_file_path = "/path/to/output_file.txt"
-    # Specify the word to remove
-    word_to_remove = 'Replaced'
-    
-    # Call the desired function 
-    # grab_subject_ids(fasttrack_path, output_file_path)
-    # filter_by_subject(fasttrack_path, output_file_path, subject_file)
-    # remove_lines_with_word(fasttrack_path, output_file_path, word_to_remove)
-    # grab_bad_data(fasttrack_path, output_file_path)
 
+def main():
+    cli_args = _cli()
+    subject_column = cli_args["subject_column"]
+    routes = []
+    if cli_args["subject_output"]:
+        routes.append(subject_route(cli_args["subject_output"], read_subjectkeys(cli_args["subject_list"]), subject_column))
+    if cli_args["remove_word_output"]:
+        routes.append(remove_word_route(cli_args["remove_word_output"], cli_args["remove_word"]))
+    if cli_args["bad_data_output"]:
+        routes.append(bad_data_route(cli_args["bad_data_output"], cli_args["usable_column"]))
+    if cli_args["subject_ids_output"]:
+        routes.append(subject_ids_route(cli_args["subject_ids_output"], subject_column))
+    run_routes(cli_args["fasttrack"], routes, subject_column)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Purpose: Loads any number of subject lists once and evaluates a set expression over them, e.g.
+"(s3 & tier1) - errors - fasttrack_bad", instead of chaining list_comparisons.py runs. Lines are matched on the
+subject (and session) in them the same way list_comparisons.py does. Also reports how many subjects are in each
+combination of lists.
+"""
+import argparse
+import ast
+import csv
+import os
+import re
+
+from list_comparisons import stream_keyed_lines, valid_path
+
+# lines without a subject ID are only kept if they look like a bare ID, so csv headers like "Subject_ID,Session_ID" are skipped
+bare_id_pattern = re.compile(r"[A-Za-z0-9]+")
+set_operators = {ast.BitAnd: "&", ast.BitOr: "|", ast.Sub: "-", ast.BitXor: "^"}
+
+def _cli():
+    """
+    :return: Dictionary with all validated command-line arguments from the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--list', dest="lists", nargs='+', required=True, type=valid_named_list,
+        help='Subject lists to load, each as name=path (e.g. s3=s3_ids.txt tier1=tier1_ids.txt errors=freesurfer_errors.csv). '
+             'Names are used in --expression'
+    )
+    parser.add_argument(
+        '--expression', dest="expression",
+        help='Set expression over the list names using & (in both), | (in either), - (in the first but not the second) '
+             'and ^ (in only one), with parentheses, e.g. "(s3 & tier1) - errors - fasttrack_bad". '
+             'If not given, only the membership counts are reported'
+    )
+    parser.add_argument(
+        '--output-file', default = os.path.join(os.getcwd(), "list_algebra.txt"), dest="output",
+        help='Path to write the subjects (and sessions) the expression gives, one per line. Default is cwd/list_algebra.txt'
+    )
+    parser.add_argument(
+        '--counts-file', dest="counts",
+        help='Optional. Path to a csv with the number of subjects in every combination of lists'
+    )
+    return vars(parser.parse_args())
+
+def valid_named_list(named_list):
+    name, _, path = named_list.partition("=")
+    if not name.isidentifier() or not path:
+        raise argparse.ArgumentTypeError(f"{named_list} should be name=path, with a name made of letters, numbers and _")
+    return name, valid_path(path)
+
+def names_subject(line, key):
+    """
+    False if no subject ID was found in a line and it isn't a bare ID either
+    """
+    return key[0] != line or bool(bare_id_pattern.fullmatch(line.strip()))
+
+def load_lists(named_lists):
+    """
+    Reads each list once into {key: bitmask of the lists it's in}, list i being bit i.
+    A subject listed without a session is counted in every session of that subject found in any list
+    """
+    key_masks = {}
+    for list_bit, (name, path) in enumerate(named_lists):
+        skipped_lines = 0
+        for line, key in stream_keyed_lines(path):
+            if not names_subject(line, key):
+                skipped_lines += 1
+                continue
+            key_masks[key] = key_masks.get(key, 0) | (1 << list_bit)
+        if skipped_lines:
+            print(f"Skipped {skipped_lines} lines without a subject ID in {path}")
+
+    sessions_by_subject = {}
+    for subject_id, session in key_masks:
+        if session is not None:
+            sessions_by_subject.setdefault(subject_id, []).append(session)
+    for subject_id, sessions in sessions_by_subject.items():
+        subject_mask = key_masks.pop((subject_id, None), 0)
+        if subject_mask:
+            for session in sessions:
+                key_masks[(subject_id, session)] |= subject_mask
+    return key_masks
+
+def compile_expression(expression, list_names):
+    """
+    Turns a set expression over list names into a function of a key's bitmask that is True if the key is in the result
+    """
+    def build(node):
+        if isinstance(node, ast.Expression):
+            return build(node.body)
+        if isinstance(node, ast.Name):
+            if node.id not in list_names:
+                raise ValueError(f"{node.id} in the expression is not one of the lists: {', '.join(list_names)}")
+            list_mask = 1 << list_names.index(node.id)
+            return lambda mask: bool(mask & list_mask)
+        if isinstance(node, ast.BinOp) and type(node.op) in set_operators:
+            left, right = build(node.left), build(node.right)
+            if isinstance(node.op, ast.BitAnd):
+                return lambda mask: left(mask) and right(mask)
+            if isinstance(node.op, ast.BitOr):
+                return lambda mask: left(mask) or right(mask)
+            if isinstance(node.op, ast.Sub):
+                return lambda mask: left(mask) and not right(mask)
+            return lambda mask: left(mask) != right(mask)
+        raise ValueError(f"Only list names, parentheses and {' '.join(set_operators.values())} can be used in the expression")
+    return build(ast.parse(expression, mode="eval"))
+
+def evaluate_expression(key_masks, expression, list_names):
+    """
+    Returns the keys in the result of the expression, in the order they were first seen.
+    Each distinct combination of lists is only evaluated once
+    """
+    in_result = compile_expression(expression, list_names)
+    mask_results = {}
+    result_keys = []
+    for key, mask in key_masks.items():
+        if mask not in mask_results:
+            mask_results[mask] = in_result(mask)
+        if mask_results[mask]:
+            result_keys.append(key)
+    return result_keys
+
+def count_memberships(key_masks):
+    """
+    Returns {bitmask: number of keys} for every combination of lists that has any keys
+    """
+    mask_counts = {}
+    for mask in key_masks.values():
+        mask_counts[mask] = mask_counts.get(mask, 0) + 1
+    return dict(sorted(mask_counts.items(), key=lambda mask_count: (-bin(mask_count[0]).count("1"), mask_count[0])))
+
+def print_memberships(mask_counts, list_names, counts_file=None):
+    """
+    Prints the number of subjects in each list and each combination of lists, and writes them to counts_file if given
+    """
+    for list_bit, name in enumerate(list_names):
+        print(f"{name}: {sum(count for mask, count in mask_counts.items() if mask & (1 << list_bit))}")
+    print("Only in:")
+    for mask, count in mask_counts.items():
+        print(f"  {' & '.join(name for list_bit, name in enumerate(list_names) if mask & (1 << list_bit))}: {count}")
+    if counts_file:
+        with open(counts_file, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(list_names + ["count"])
+            for mask, count in mask_counts.items():
+                writer.writerow([int(bool(mask & (1 << list_bit))) for list_bit in range(len(list_names))] + [count])
+        print(f'Data written to {counts_file}')
+
+def main():
+    cli_args = _cli()
+    named_lists = cli_args["lists"]
+    list_names = [name for name, _ in named_lists]
+    if len(set(list_names)) != len(list_names):
+        raise ValueError("Each list needs its own name")
+    key_masks = load_lists(named_lists)
+    print_memberships(count_memberships(key_masks), list_names, cli_args["counts"])
+    if cli_args["expression"]:
+        result_keys = evaluate_expression(key_masks, cli_args["expression"], list_names)
+        with open(cli_args["output"], 'w') as output:
+            for subject_id, session in result_keys:
+                output.write(f"{subject_id},{session}\n" if session else f"{subject_id}\n")
+        print(f"{cli_args['expression']}: {len(result_keys)}")
+        print(f'Data written to {cli_args["output"]}')
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,35 @@
-import pandas as pd
 import argparse
 import os
+import re
 
-# TODO: Take into account sessions (currently assumes that we are just comparing subjects from the same year)
-# TODO: Account for files that have headings 
-#       TODO: Ask for heading input/smartly figure out which column/assume first column is subject 
+from row_filter import filter_rows, read_ids
+
+# TODO: Account for files that have headings
+#       TODO: Ask for heading input/smartly figure out which column/assume first column is subject
 #       TODO: Add heading consideration
 # TODO: Can add a function to grab a subject list from a s3 bucket/directory path
 #       TODO: Can steal s3 functionality from abcd-hcp-pipeline audit script
 
+# Lines are compared on the subject (and session) found in them rather than the raw line, so "sub-NDARINVXXXXXXXX",
+# "NDARINVXXXXXXXX,2YearFollowUpYArm1" and an NDA table row with "NDAR_INVXXXXXXXX" all name the same subject.
+# NDA GUIDs are found anywhere in a line, other IDs need their "sub-" prefix, and a line with neither is its own key
+subject_pattern = re.compile(r"NDAR_?(INV[A-Z0-9]{8})|sub-([A-Za-z0-9]+)")
+# BIDS sessions ("ses-2YearFollowUpYArm1"), bare ABCD sessions ("baselineYear1Arm1") and NDA eventnames ("baseline_year_1_arm_1")
+session_pattern = re.compile(r"ses-([A-Za-z0-9]+)|\b([A-Za-z0-9]+Arm[0-9]+)\b|\b([a-z0-9]+(?:_[a-z0-9]+)*_arm_[0-9]+)\b")
+
 def _cli():
     """
     :return: Dictionary with all validated command-line arguments from the user
     """
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        '--input-1', dest="file1", type = valid_path, 
+        '--input-1', dest="file1", type = valid_path,
         help='Path to a subject list (.tsv/.csv/.txt)'
     )
     parser.add_argument(
         '--input-2', dest="file2", type = valid_path,
-        help=('Path to a different subject list (.tsv/.csv/.txt)' 
-        'File extension should be that same for both input files')
+        help=('Path to a different subject list (.tsv/.csv/.txt). '
+        'Lines are matched on the subject and session IDs in them, so the two files can be in different formats')
     )
     parser.add_argument(
         '--output-file', default = os.path.join(os.getcwd(), "comparison.txt"), dest="output",
@@ -29,106 +37,169 @@ def _cli():
     )
     parser.add_argument(
         '--function', type = valid_operation, dest="func",
-        help=('What function to run. Can print out number of unique subjects, write out values that are in both files, remove doubles,',
-        'print subjects that only exist in the first list, or remove subjects in the first file from the second file. Input must be one of the following:',
-        'count-unique, write-overlap, remove-doubles, write-unique, remove-subjects')
+        help=('What function to run. Can print out number of unique subjects, write out values that are in both files, remove doubles, '
+        'print subjects that only exist in the first list, or remove subjects in the first file from the second file. Input must be one of the following: '
+        'count-unique, write-overlap, remove-doubles, write-unique, remove-subjects. '
+        'A line with only a subject matches every session of that subject in the other file')
+    )
+    parser.add_argument(
+        '--match', default = "key", choices = ["key", "word", "substring"], dest="match",
+        help=('How remove-subjects matches the lines of the first file in the second. Default is key, the subject and session IDs. '
+        'word matches each line as a whole word (like grep "\\bID\\b") and substring anywhere in the line')
     )
     # parser.add_argument(
-    #     '--header', dest="head", 
+    #     '--header', dest="head",
     #     help='Name of column that contains subject IDs (for files with headers)'
     # )
     # parser.add_argument(
     #     '--path', dest="dir", type = valid_path,
-    #     help='Path to a BIDS/derivatives directory or s3 bucket to get a subject list of contents (will pull subject IDs from top level directories)' 
+    #     help='Path to a BIDS/derivatives directory or s3 bucket to get a subject list of contents (will pull subject IDs from top level directories)'
     # )
     return vars(parser.parse_args())
 
 def valid_operation(choice):
     functions = ["count-unique", "write-overlap", "remove-doubles", "write-unique", "remove-subjects"]
-    return choice in functions
+    if choice not in functions:
+        raise argparse.ArgumentTypeError(f"{choice} is not one of: {', '.join(functions)}")
+    return choice
 
 def valid_path(path):
-    return os.path.exists(path) and os.access(path, os.R_OK)
+    if not (os.path.exists(path) and os.access(path, os.R_OK)):
+        raise argparse.ArgumentTypeError(f"{path} does not exist or is not readable")
+    return path
 
-def count_unique_subjects(input_file):
+def get_line_key(line):
     """
-    Takes in a subject ID file
-    Prints out the number of unique lines that start with a subject ID
+    Returns the (subject, session) named in a line, session being None if there isn't one,
+    or (line, None) if no subject is found
     """
-    sub_lines = []
-    # Looks for lines that start with "sub-" or "NDARIN" to find subject IDs
-    with open(input_file, "r") as input_file:
-        for line in input_file:
-            if line.startswith("sub-") or line.startswith("NDARIN"):
-                sub_lines.append(line.strip()) 
-
-    df = pd.DataFrame({"Subjects": sub_lines})
-    unique_count = df["Subjects"].nunique()
+    subject = subject_pattern.search(line)
+    if subject is None:
+        return line, None
+    subject_id = f"NDAR{subject.group(1)}" if subject.group(1) else subject.group(2)
+    session = session_pattern.search(line)
+    if session is None:
+        return subject_id, None
+    if session.group(3):
+        # baseline_year_1_arm_1 -> baselineYear1Arm1
+        first_word, *other_words = session.group(3).split("_")
+        return subject_id, first_word + "".join(word.capitalize() for word in other_words)
+    return subject_id, session.group(1) or session.group(2)
+
+def stream_keyed_lines(input_file):
+    """
+    Yields (line, key) for each non-empty line of input_file, one line at a time
+    """
+    with open(input_file, 'r') as in_file:
+        for line in in_file:
+            line = line.rstrip("\r\n")
+            if line.strip():
+                yield line, get_line_key(line)
 
-    print("Unique subjects:", unique_count)
+def read_key_index(input_file):
+    """
+    Returns {subject: set of sessions} for every line of input_file, None standing for a line with no session
+    """
+    key_index = {}
+    for _, (subject_id, session) in stream_keyed_lines(input_file):
+        key_index.setdefault(subject_id, set()).add(session)
+    return key_index
 
-def compare_files(file1, file2, output_file):
+def key_in_index(key, key_index):
     """
-    Takes in two input subject ID files of the same format and an output file
-    Writes file of subject IDs that exist in both files 
+    True if the key's subject is in the index with the same session, or either one has no session
     """
-    with open(file1, 'r') as f1, open(file2, 'r') as f2:
-        lines1 = set(f1.readlines())
-        lines2 = set(f2.readlines())
-        common_lines = lines1.intersection(lines2) 
-    print("Overlapping values:",len(common_lines))
+    sessions = key_index.get(key[0])
+    if not sessions:
+        return False
+    return key[1] is None or key[1] in sessions or None in sessions
 
+def stream_lines_matching(stream_file, other_file, keep_matching=True):
+    """
+    Yields (line, key) for the lines of stream_file, in order, whose key is (or with keep_matching=False, isn't) in other_file.
+    Only the smaller of the two files is held in memory as a key index, the other is read a line at a time
+    """
+    if os.path.getsize(other_file) <= os.path.getsize(stream_file):
+        key_index = read_key_index(other_file)
+    else:
+        # index the smaller stream_file, then keep only the keys from other_file that match something in it
+        stream_index = read_key_index(stream_file)
+        key_index = {}
+        for _, key in stream_keyed_lines(other_file):
+            if key_in_index(key, stream_index):
+                key_index.setdefault(key[0], set()).add(key[1])
+    for line, key in stream_keyed_lines(stream_file):
+        if key_in_index(key, key_index) == keep_matching:
+            yield line, key
+
+def write_lines(lines, output_file):
+    """
+    Writes lines to output_file as they come and returns how many there were
+    """
+    line_count = 0
     with open(output_file, 'w') as output:
-        output.write("\n".join(common_lines))
+        for line in lines:
+            output.write(line + "\n")
+            line_count += 1
+    return line_count
+
+def unique_by_key(lines_and_keys):
+    """
+    Yields the first line seen for each key
+    """
+    seen_keys = set()
+    for line, key in lines_and_keys:
+        if key not in seen_keys:
+            seen_keys.add(key)
+            yield line
+
+def count_unique_subjects(input_file):
+    """
+    Takes in a subject ID file
+    Prints out the number of unique subjects (and sessions) named in it
+    """
+    unique_keys = {key for line, key in stream_keyed_lines(input_file) if line.startswith("sub-") or key[0].startswith("NDARINV")}
+    print("Unique subjects:", len(unique_keys))
 
+def compare_files(file1, file2, output_file):
+    """
+    Takes in two input subject ID files and an output file
+    Writes file of the lines of file1 whose subject IDs also exist in file2, in the order they're in
+    """
+    common_lines = stream_lines_matching(file1, file2)
+    overlap_count = write_lines(unique_by_key(common_lines), output_file)
+    print("Overlapping values:", overlap_count)
     print(f'Data written to {output_file}')
 
 def lines_not_overlapping(file1_path, file2_path, output_path):
     """
     Writes out lines that are only in file1_path
     """
-    with open(file1_path, 'r') as f1, open(file2_path, 'r') as f2:
-        lines1 = set(f1.readlines())
-        lines2 = set(f2.readlines())
-
-    lines_unique_to_file1 = lines1 - lines2
-
-    print("Subjects only in first list:",len(lines_unique_to_file1))
-    with open(output_path, 'w') as output:
-        output.writelines(lines_unique_to_file1)
+    unique_lines = stream_lines_matching(file1_path, file2_path, keep_matching=False)
+    unique_count = write_lines(unique_by_key(unique_lines), output_path)
+    print("Subjects only in first list:", unique_count)
     print(f'Data written to {output_path}')
 
-def remove_subjects(subject_file, input_file, output_file):
+def remove_subjects(subject_file, input_file, output_file, match="key"):
     """
-    Removes lines from input_file that are also in subject_file
+    Removes lines from input_file whose subject IDs are also in subject_file,
+    or with match as word or substring, that contain a line of subject_file
     """
-    with open(subject_file, 'r') as sub_file:
-        subjects = set(sub_file.read().splitlines())
-
-    good_lines = []
-    with open(input_file, 'r') as in_file:
-        for line in in_file:
-            line = line.strip()
-            if not any(sub in line for sub in subjects):
-                good_lines.append(line)
-    print("Remaining subjects:",len(good_lines))
-   
-    with open(output_file, 'w') as output:
-        output.write("\n".join(good_lines))
+    if match == "key":
+        good_lines = (line for line, _ in stream_lines_matching(input_file, subject_file, keep_matching=False))
+    else:
+        good_lines = filter_rows((line for line, _ in stream_keyed_lines(input_file)), read_ids(subject_file),
+                                 substring=match == "substring")
+    remaining_count = write_lines((line.strip() for line in good_lines), output_file)
+    print("Remaining subjects:", remaining_count)
     print(f'Data written to {output_file}')
 
 def remove_duplicates(input_file, output_file):
     """
-    Force list of subjects into set to remove duplicate entries
+    Keeps the first line for each subject (and session), in the order they're in
     """
-    singles = set()
-    with open(input_file, 'r') as in_file:
-        for line in in_file:
-            singles.add(line.strip())
-
-    print("Number of subjects w/o duplicates:",len(singles))
-    with open(output_file, 'w') as output:
-        output.write("\n".join(singles))
+    single_count = write_lines((line.strip() for line in unique_by_key(stream_keyed_lines(input_file))), output_file)
+    print("Number of subjects w/o duplicates:", single_count)
     print(f'Data written to {output_file}')
 
 def make_func_dict():
@@ -137,27 +208,19 @@ def make_func_dict():
 
 def main():
     cli_args = _cli()
-    input1 = cli_args.file1
-    input2 = cli_args.file2
-    output = cli_args.output
-    operation = cli_args.func
+    input1 = cli_args["file1"]
+    input2 = cli_args["file2"]
+    output = cli_args["output"]
+    operation = cli_args["func"]
     choices = make_func_dict()
     if "count" in operation:
         choices[operation](input1)
     elif "doubles" in operation:
         choices[operation](input1, output)
+    elif operation == "remove-subjects":
+        choices[operation](input1, input2, output, cli_args["match"])
     else:
         choices[operation](input1, input2, output)
 
 if __name__ == '__main__':
     main()
-
-
-		
-
-
-
-
-
-
-
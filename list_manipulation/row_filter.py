@@ -0,0 +1,122 @@
+"""
+Purpose: Removes (or keeps) the rows of a file that contain any of a list of subject IDs, streaming the file a row at a time.
+Matches whole words by default, the same as the grep -vE "\bID\b|..." in remove_rows_from_csv.sh, or any substring with --substring.
+Word matches split each row into words and look them up in a set of the IDs, substring matches use one regex built as a
+trie of the IDs, so the time taken grows with the size of the file rather than the number of IDs.
+"""
+import argparse
+import os
+import re
+
+# grep's word characters: letters, digits and _
+word_pattern = re.compile(r"\w+", re.ASCII)
+
+def _cli():
+    """
+    :return: Dictionary with all validated command-line arguments from the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--ids', dest="id_file", required=True,
+        help='Path to a file of subject IDs (or any other strings), one per line'
+    )
+    parser.add_argument(
+        '--input', dest="input_file", required=True,
+        help='Path to the file to filter (.csv/.tsv/.txt)'
+    )
+    parser.add_argument(
+        '--output-file', dest="output",
+        help='Path to write the filtered rows to. Default is to replace the input file, like remove_rows_from_csv.sh'
+    )
+    parser.add_argument(
+        '--substring', action="store_true",
+        help='Match IDs anywhere in a row instead of only as whole words'
+    )
+    parser.add_argument(
+        '--keep-matching', dest="keep_matching", action="store_true",
+        help='Keep the rows with a matching ID instead of removing them'
+    )
+    return vars(parser.parse_args())
+
+def read_ids(id_file):
+    """
+    Returns the non-empty lines of id_file, stripped of whitespace
+    """
+    with open(id_file, 'r') as ids:
+        return [line.strip() for line in ids if line.strip()]
+
+def build_trie_pattern(ids):
+    """
+    Returns a regex matching any of ids, nested by shared prefixes ("NDARINV(?:A(?:...)|B(?:...))") so that
+    each position in a row is only checked against the IDs that could still match it
+    """
+    trie = {}
+    for id_string in ids:
+        node = trie
+        for char in id_string:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def node_pattern(node):
+        branches = [re.escape(char) + node_pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # an ID ends here but longer ones carry on, the longer ones are tried first
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return node_pattern(trie)
+
+def build_row_filter(ids, substring=False):
+    """
+    Returns a function that is True for a row containing any of ids, either anywhere (substring)
+    or only as whole words, with the same word boundaries as grep's \\b
+    """
+    ids = set(ids)
+    if not ids:
+        return lambda row: False
+    if substring:
+        return re.compile(build_trie_pattern(ids)).search
+
+    word_ids = {id_string for id_string in ids if word_pattern.fullmatch(id_string)}
+    # IDs like "sub-NDARINVXXXXXXXX" span more than one word, so they're matched with a \b bounded regex instead
+    other_ids = ids - word_ids
+    other_search = re.compile(r"\b(?:" + build_trie_pattern(other_ids) + r")\b", re.ASCII).search if other_ids else None
+    def row_matches(row):
+        if not word_ids.isdisjoint(word_pattern.findall(row)):
+            return True
+        return other_search is not None and other_search(row) is not None
+    return row_matches
+
+def filter_rows(rows, ids, substring=False, keep_matching=False):
+    """
+    Yields the rows without any of ids (or with keep_matching, only the rows with one)
+    """
+    row_matches = build_row_filter(ids, substring)
+    for row in rows:
+        if bool(row_matches(row)) == keep_matching:
+            yield row
+
+def filter_file(input_file, output_file, ids, substring=False, keep_matching=False):
+    """
+    Writes the filtered rows of input_file to output_file, which can be input_file, and returns how many rows were kept
+    """
+    temp_file = f"{output_file}.new"
+    kept_rows = 0
+    # newline="" keeps each row's own line ending, the same as grep
+    with open(input_file, 'r', newline='') as in_file, open(temp_file, 'w', newline='') as out_file:
+        for row in filter_rows(in_file, ids, substring, keep_matching):
+            out_file.write(row)
+            kept_rows += 1
+    os.replace(temp_file, output_file)
+    return kept_rows
+
+def main():
+    cli_args = _cli()
+    output_file = cli_args["output"] or cli_args["input_file"]
+    ids = read_ids(cli_args["id_file"])
+    kept_rows = filter_file(cli_args["input_file"], output_file, ids, cli_args["substring"], cli_args["keep_matching"])
+    print(f"{kept_rows} rows written to '{output_file}'.")
+
+if __name__ == '__main__':
+    main()
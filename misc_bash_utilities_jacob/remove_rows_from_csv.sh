@@ -21,19 +21,9 @@ if [ ! -f "$data_file" ]; then
   exit 1
 fi
 
-# Loop through the subject IDs and create a grep pattern to match them
-grep_pattern=""
-while IFS= read -r subject_id || [ -n "$subject_id" ]; do
-  grep_pattern+="\b${subject_id}\b|"
-done < "$subject_ids_file"
-
-# Remove the trailing "|" from the grep_pattern
-grep_pattern=${grep_pattern%|}
-
-# Filter out the rows matching subject IDs and create a new data file
-grep -vE "$grep_pattern" "$data_file" > "${data_file}.new"
-
-# Replace the original data file with the new one
-mv "${data_file}.new" "$data_file"
+# Filter out the rows matching subject IDs (as whole words, like grep "\bID\b") and replace the original data file
+# row_filter.py looks each word up in a set of the IDs instead of building one grep pattern out of all of them,
+# which gets slow and can go over the argument length limit with thousands of IDs
+python3 "$(dirname "$0")/../list_manipulation/row_filter.py" --ids "$subject_ids_file" --input "$data_file" || exit 1
 
 echo "Rows with matching subject IDs removed from '$data_file'."
@@ -0,0 +1,159 @@
+"""
+Purpose: Runs filter-cubids-errors.py, separate-errors-into-csvs.py and create_subject_lists.py as one command.
+Each row of the cubids validation tsv is filtered, written to its error's <error>-errors.txt and its subject and
+session added to <error>-subjects.txt as it's read, so the tsv is read once and no intermediate file is re-read.
+Prints how many rows each stage kept and how long it took.
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import time
+from contextlib import ExitStack
+
+# The errors filter-cubids-errors.py removes by default
+default_remove_errors = ["NOT_INCLUDED", "INCONSISTENT_PARAMETERS", "EVENTS_TSV_MISSING", "TASK_NAME_CONTAIN_ILLEGAL_CHARACTER",
+                         "SLICE_TIMING_NOT_DEFINED", "TASK_NAME_MUST_DEFINE"]
+
+
+def _cli():
+    """
+    :return: Dictionary with all validated command-line arguments from the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', dest="input_tsv", required=True,
+        help='Path to the cubids validation tsv'
+    )
+    parser.add_argument(
+        '--output-dir', dest="output_dir", default=os.getcwd(),
+        help='Directory to write the <error>-errors.txt and <error>-subjects.txt files to. Default is cwd'
+    )
+    filter_group = parser.add_mutually_exclusive_group()
+    filter_group.add_argument(
+        '--remove-errors', dest="remove_errors", nargs='*', default=default_remove_errors,
+        help=f'Remove rows with any of these errors (option 1 of filter-cubids-errors.py). Default is {" ".join(default_remove_errors)}. '
+             'Give no errors to keep every row'
+    )
+    filter_group.add_argument(
+        '--keep-error', dest="keep_error",
+        help='Only keep rows containing this error, e.g. INTENDED_FOR (option 2 of filter-cubids-errors.py)'
+    )
+    parser.add_argument(
+        '--filtered-output', dest="filtered_output",
+        help='Optional. Path to also write the filtered tsv to, like filter-cubids-errors.py'
+    )
+    parser.add_argument(
+        '--error-column', dest="error_column", type=int, default=1,
+        help='Index of the column with the error code, counting from 0. Default is 1 (the second column)'
+    )
+    return vars(parser.parse_args())
+
+
+def get_error_name(error):
+    return error.lower().replace(os.sep, '_')
+
+
+def build_row_filter(remove_errors=None, keep_error=None):
+    """True for rows that get through the filter stage"""
+    if keep_error:
+        return lambda row, line: keep_error in line
+    remove_errors = set(remove_errors or [])
+    return lambda row, line: remove_errors.isdisjoint(row)
+
+
+def get_subject_session(row):
+    """(subject, session) from a row's path, e.g. /sub-X/ses-Y/anat/..., or None if the path is too short"""
+    parts = row[0].split('/')
+    return (parts[1], parts[2]) if len(parts) > 2 else None
+
+
+def run_pipeline(input_tsv, output_dir, remove_errors=None, keep_error=None, filtered_output=None, error_column=1):
+    """
+    Streams input_tsv through the filter, split and subject list stages.
+    Returns ({stage: rows out of it}, {stage: seconds spent in it}, {error: (rows, subject sessions)})
+    """
+    row_filter = build_row_filter(remove_errors, keep_error)
+    row_counts = {"read": 0, "filter": 0, "deduplicate": 0, "split": 0, "subject lists": 0}
+    stage_times = dict.fromkeys(row_counts, 0.0)
+    seen_lines = set()
+    error_files = {}
+    subject_files = {}
+    subject_sessions = {}
+    error_counts = {}
+    start = time.perf_counter()
+    with open(input_tsv, 'r', newline='') as tsvfile, ExitStack() as open_files:
+        reader = csv.reader(tsvfile, delimiter='\t')
+        header = next(reader, None)
+        filtered_writer = None
+        if filtered_output:
+            filtered_writer = csv.writer(open_files.enter_context(open(filtered_output, 'w', newline='')), delimiter='\t')
+            if header is not None:
+                filtered_writer.writerow(header)
+        for row in reader:
+            row_counts["read"] += 1
+            line = '\t'.join(row)
+
+            stage_start = time.perf_counter()
+            keep_row = row_filter(row, line)
+            stage_times["filter"] += time.perf_counter() - stage_start
+            if not keep_row:
+                continue
+            row_counts["filter"] += 1
+
+            stage_start = time.perf_counter()
+            line_hash = hashlib.blake2b(line.encode(), digest_size=16).digest()
+            duplicate = line_hash in seen_lines
+            seen_lines.add(line_hash)
+            stage_times["deduplicate"] += time.perf_counter() - stage_start
+            if duplicate:
+                continue
+            row_counts["deduplicate"] += 1
+            if filtered_writer is not None:
+                filtered_writer.writerow(row)
+
+            if len(row) <= error_column:
+                continue
+            stage_start = time.perf_counter()
+            error = row[error_column]
+            if error not in error_files:
+                error_name = get_error_name(error)
+                error_files[error] = open_files.enter_context(open(os.path.join(output_dir, f"{error_name}-errors.txt"), 'w'))
+                subject_files[error] = open_files.enter_context(open(os.path.join(output_dir, f"{error_name}-subjects.txt"), 'w'))
+                subject_sessions[error] = set()
+                error_counts[error] = [0, 0]
+            error_files[error].write(line + '\n')
+            error_counts[error][0] += 1
+            row_counts["split"] += 1
+            stage_times["split"] += time.perf_counter() - stage_start
+
+            stage_start = time.perf_counter()
+            subject_session = get_subject_session(row)
+            if subject_session is not None:
+                row_counts["subject lists"] += 1
+                if subject_session not in subject_sessions[error]:
+                    subject_sessions[error].add(subject_session)
+                    subject_files[error].write(f"{subject_session[0]},{subject_session[1]}\n")
+                    error_counts[error][1] += 1
+            stage_times["subject lists"] += time.perf_counter() - stage_start
+    stage_times["read"] = time.perf_counter() - start - sum(stage_times.values())
+    return row_counts, stage_times, {error: tuple(counts) for error, counts in error_counts.items()}
+
+
+def print_summary(row_counts, stage_times, error_counts, output_dir):
+    for stage, row_count in row_counts.items():
+        print(f"{stage}: {row_count} rows, {stage_times[stage]:.3f}s")
+    for error, (row_count, subject_count) in error_counts.items():
+        error_name = get_error_name(error)
+        print(f"{os.path.join(output_dir, error_name)}-errors.txt: {row_count} rows, {error_name}-subjects.txt: {subject_count} subject sessions")
+
+
+def main():
+    cli_args = _cli()
+    results = run_pipeline(cli_args["input_tsv"], cli_args["output_dir"], cli_args["remove_errors"], cli_args["keep_error"],
+                           cli_args["filtered_output"], cli_args["error_column"])
+    print_summary(*results, cli_args["output_dir"])
+
+if __name__ == "__main__":
+    main()
@@ -2,67 +2,80 @@
 Author: rae McCollum
 Created: 10 Oct 23
 Last Modified: 11 Nov 23
-Purpose: Given a list of errors, search through a cubids file and copy each type of error found to their own txt
+Purpose: Search through a cubids file and copy each type of error found to their own txt, in one read of the file.
+Error files are opened as each error is first found, so any error code gets a file, and repeated lines are skipped
+as they're read (keeping a hash of each line written, not the lines).
 """
 
+import argparse
 import csv
+import hashlib
+import os
+from contextlib import ExitStack
 
-# Define the list of errors 
-errors = [
-    "EMPTY_FILE",
-    "BOLD_NOT_4D",
-    "NIFTI_PIXDIM4",
-    "INTENDED_FOR",
-    "PHASE_ENCODING_DIRECTION_MUST_DEFINE",
-    "VOLUME_COUNT_MISMATCH",
-    "REPETITION_TIME_MUST_DEFINE",
-    "SESSION_LABEL_IN_FILENAME_DOESNOT_MATCH_DIRECTORY",
-    "TOTAL_READOUT_TIME_MUST_DEFINE",
-    "NIFTI_TOO_SMALL",
-    "DWI_MISSING_BVEC",
-    "DWI_MISSING_BVAL",
-    "QUICK_VALIDATION_FAILED",
-    "INVALID JSON ENCODING"
-]
 
-# Create a dictionary to hold lines for each error
-error_lines = {error: [] for error in errors}
+def _cli():
+    """
+    :return: Dictionary with all validated command-line arguments from the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', dest="input_tsv", required=True,
+        help='Path to the cubids validation tsv (e.g. parsed_year2_errors.csv)'
+    )
+    parser.add_argument(
+        '--output-dir', dest="output_dir", default=os.getcwd(),
+        help='Directory to write the <error>-errors.txt files to. Default is cwd'
+    )
+    parser.add_argument(
+        '--error-column', dest="error_column", type=int, default=1,
+        help='Index of the column with the error code, counting from 0. Default is 1 (the second column)'
+    )
+    return vars(parser.parse_args())
 
-# Define the input file path
-input_tsv = '/home/rando149/shared/projects/rae_testing/abcc_s3_cubids/parsed_year2_errors.csv'
 
-process_tsv(input_tsv, error_lines)
+def get_error_file(error, output_dir):
+    return os.path.join(output_dir, f"{error.lower().replace(os.sep, '_')}-errors.txt")
 
-def remove_duplicates(input_file):
-    # Read lines from the input file
-    with open(input_file, 'r') as file:
-        lines = file.readlines()
 
-    # Remove duplicates while preserving order
-    unique_lines = list(dict.fromkeys(lines))
-
-    # Write back to the same file
-    with open(input_file, 'w') as file:
-        file.writelines(unique_lines)
-
-def process_tsv(input_tsv, error_lines):
-    # Read the TSV file
-    with open(input_tsv, 'r', newline='') as tsvfile:
+def process_tsv(input_tsv, output_dir, error_column=1):
+    """
+    Writes each row of input_tsv (after the header) to the file for its error, once, in the order they're in.
+    Returns {error: number of rows written}
+    """
+    seen_lines = set()
+    error_files = {}
+    rows_written = {}
+    skipped_rows = 0
+    with open(input_tsv, 'r', newline='') as tsvfile, ExitStack() as open_files:
         reader = csv.reader(tsvfile, delimiter='\t')
-        next(reader)
+        next(reader, None)
         for row in reader:
-            error = row[1]  # Assuming error is in the second column, adjust if necessary
-            error_lines[error].append('\t'.join(row))
+            if len(row) <= error_column:
+                skipped_rows += 1
+                continue
+            error = row[error_column]
+            line = '\t'.join(row)
+            line_hash = hashlib.blake2b(line.encode(), digest_size=16).digest()
+            if line_hash in seen_lines:
+                continue
+            seen_lines.add(line_hash)
+            if error not in error_files:
+                error_files[error] = open_files.enter_context(open(get_error_file(error, output_dir), 'w'))
+                rows_written[error] = 0
+            error_files[error].write(line + '\n')
+            rows_written[error] += 1
+    if skipped_rows:
+        print(f"Skipped {skipped_rows} rows without an error column")
+    return rows_written
+
+
+def main():
+    cli_args = _cli()
+    rows_written = process_tsv(cli_args["input_tsv"], cli_args["output_dir"], cli_args["error_column"])
+    for error, row_count in rows_written.items():
+        print(f"{get_error_file(error, cli_args['output_dir'])}: {row_count} rows")
+    print("Files created successfully.")
 
-    # Write lines to separate files
-    written_files = []
-    for error, lines in error_lines.items():
-        if lines:
-            output_file = f"{error.lower()}-errors.txt"
-            written_files.append(output_file)
-            with open(output_file, 'w') as f:
-                f.write('\n'.join(lines))
-    for path in written_files:
-	    remove_duplicates(path)            
-            
-print("Files created successfully.")
+if __name__ == "__main__":
+    main()
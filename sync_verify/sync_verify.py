@@ -0,0 +1,389 @@
+"""
+Purpose: Verifies that a local directory and an s3 path (or two of either) are in sync. Each side is listed once,
+the two listings are joined on the path relative to each root, and any missing, extra or different sized files are reported.
+With --checksum, local files are hashed in parallel into the ETag s3 would give them (including multipart uploads)
+so file contents are compared without a request per object.
+"""
+import os
+import sys
+import csv
+import boto3
+import sqlite3
+import hashlib
+import argparse
+import configparser
+from botocore.config import Config
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# part sizes tried when working out the ETag of a multipart upload, s3cmd defaults to 15MB parts and the aws cli to 8MB
+default_multipart_chunk_sizes_mb = [15, 8, 16, 5, 64, 100]
+# most whole MB part sizes tried on top of those when none of them gives the ETag's number of parts
+max_inferred_part_sizes = 16
+# read size when hashing, large reads keep a network filesystem streaming
+hash_read_bytes = 8 * 1024 * 1024
+# hashes written to the --hash-cache at a time, so an interrupted run keeps all but the last few
+hash_cache_batch = 100
+
+
+def _cli():
+    """
+    :return: Dictionary with all validated command-line arguments from the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--source-path', dest="source_path",
+        help='Local directory or s3:// path that was synced from. Required unless --verify-list is given'
+    )
+    parser.add_argument(
+        '--dest-path', dest="dest_path", required=True,
+        help='Local directory or s3:// path that was synced to'
+    )
+    parser.add_argument(
+        '--verify-list', dest="verify_list",
+        help='Optional. Path to a txt file of source paths, one per line, each verified against --dest-path in turn. '
+             'Replaces --source-path'
+    )
+    parser.add_argument(
+        '--checksum', action="store_true",
+        help='Also compare file contents. Local files are hashed into the ETag s3 would give them, '
+             'so only files that exist on both sides with the same size are read'
+    )
+    parser.add_argument(
+        '--multipart-chunk-size-mb', dest="multipart_chunk_sizes_mb", nargs='+', type=int,
+        default=default_multipart_chunk_sizes_mb,
+        help='Part sizes (in MB) tried when matching a multipart ETag, defaults to 15 (s3cmd) and 8 (aws cli) '
+             'followed by a few other common sizes. Other whole MB part sizes that fit the ETag\'s part count are tried too'
+    )
+    parser.add_argument(
+        '--workers', default=os.cpu_count(), type=int,
+        help='Number of processes hashing local files for --checksum, defaults to the number of cores'
+    )
+    parser.add_argument(
+        '--hash-cache', dest="hash_cache",
+        help='Optional. Path to an SQLite file that keeps the md5, sha1 and ETags of every local file hashed, '
+             'keyed by its path, size, mtime and inode. Later --checksum runs only hash files that are new or have changed, '
+             'and a run that is stopped part way picks up where it left off. The file is created if it doesn\'t exist'
+    )
+    parser.add_argument(
+        '--report',
+        help='Optional. Path to a csv listing every file that is missing, extra or different, with both sizes'
+    )
+    parser.add_argument(
+        '--host', default=None,
+        help='s3 host url. Defaults to host_base in ~/.s3cfg, or s3.msi.umn.edu'
+    )
+    parser.add_argument(
+        '--access_key', default=None,
+        help='s3 access key. Defaults to access_key in ~/.s3cfg. If using MSI, run s3info to find'
+    )
+    parser.add_argument(
+        '--secret_key', default=None,
+        help='s3 secret key. Defaults to secret_key in ~/.s3cfg. If using MSI, run s3info to find'
+    )
+    parser.add_argument(
+        '--max_attempts', default=10, type=int,
+        help='Times each s3 request is tried before giving up, backing off between tries when s3 is throttling or erroring. '
+             'Defaults to 10'
+    )
+    cli_args = vars(parser.parse_args())
+    if not cli_args["source_path"] and not cli_args["verify_list"]:
+        parser.error("either --source-path or --verify-list is required")
+    return cli_args
+
+
+def read_s3cfg(s3cfg_path=os.path.expanduser("~/.s3cfg")):
+    # Returns the host and keys s3cmd is set up with, so the same credentials work here
+    s3cfg = configparser.ConfigParser(interpolation=None)
+    s3cfg.read(s3cfg_path)
+    if not s3cfg.has_section("default"):
+        return {}
+    host = s3cfg["default"].get("host_base")
+    if host and not host.startswith("http"):
+        host = f"https://{host}"
+    return {"host": host, "access_key": s3cfg["default"].get("access_key"), "secret_key": s3cfg["default"].get("secret_key")}
+
+
+def create_s3_client(host, access_key, secret_key, max_attempts=10):
+    # Create s3 client to access bucket, with "standard" retries backing off when the endpoint throttles or returns a 5xx
+    session = boto3.Session()
+    config = Config(retries={"total_max_attempts": max_attempts, "mode": "standard"})
+    return session.client('s3', endpoint_url=host, aws_access_key_id=access_key, aws_secret_access_key=secret_key, config=config)
+
+
+def split_s3_path(s3_path):
+    # Returns the bucket name and the key prefix of an s3:// path, the prefix ending in "/" unless it's empty
+    bucket, _, prefix = s3_path[len("s3://"):].partition("/")
+    prefix = prefix.strip("/")
+    return bucket, f"{prefix}/" if prefix else ""
+
+
+def list_local_files(local_path):
+    # Returns {path relative to local_path: {"Size", "Path"}} for every file under local_path
+    local_files = {}
+    if os.path.isfile(local_path):
+        stat = os.stat(local_path)
+        return {os.path.basename(local_path): {"Size": stat.st_size, "Path": local_path,
+                                               "Mtime": stat.st_mtime_ns, "Inode": stat.st_ino}}
+    dirs = [local_path]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.is_file():
+                    relative_path = os.path.relpath(entry.path, local_path).replace(os.sep, "/")
+                    stat = entry.stat()
+                    local_files[relative_path] = {"Size": stat.st_size, "Path": entry.path,
+                                                  "Mtime": stat.st_mtime_ns, "Inode": stat.st_ino}
+    return local_files
+
+
+def list_s3_files(s3, s3_path):
+    # Returns {key relative to s3_path: {"Size", "ETag"}} for every object under s3_path, from one paginated listing
+    bucket, prefix = split_s3_path(s3_path)
+    s3_files = {}
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            relative_key = obj["Key"][len(prefix):]
+            # keys ending in "/" are folder markers, not files
+            if relative_key and not relative_key.endswith("/"):
+                s3_files[relative_key] = {"Size": obj["Size"], "ETag": obj["ETag"].strip('"')}
+    return s3_files
+
+
+def list_files(path, s3=None):
+    if path.startswith("s3://"):
+        return list_s3_files(s3, path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} does not exist")
+    return list_local_files(path)
+
+
+def compare_listings(source_files, dest_files):
+    # Returns the relative paths only in the source, only in the destination, and in both but with different sizes
+    missing = sorted(source_files.keys() - dest_files.keys())
+    extra = sorted(dest_files.keys() - source_files.keys())
+    size_mismatch = sorted(relative_path for relative_path in source_files.keys() & dest_files.keys()
+                           if source_files[relative_path]["Size"] != dest_files[relative_path]["Size"])
+    return missing, extra, size_mismatch
+
+
+def get_etag_part_sizes(size, etag, multipart_chunk_sizes):
+    # Returns the part sizes that could have made a multipart ETag ("<md5 of part md5s>-<number of parts>")
+    parts = int(etag.rsplit("-", 1)[1])
+    mb = 1024 * 1024
+    # any part size at least as big as the file gives the same single part ETag
+    if parts == 1:
+        return [max(size, 1)]
+    # every whole MB part size that gives this many parts is tried too (up to max_inferred_part_sizes of them),
+    # for uploads with an unusual part size
+    smallest_mb = -(-size // (parts * mb))
+    largest_mb = (size - 1) // ((parts - 1) * mb)
+    inferred_part_sizes = [part_mb * mb for part_mb in range(smallest_mb, largest_mb + 1)][:max_inferred_part_sizes]
+    part_sizes = list(multipart_chunk_sizes) + inferred_part_sizes
+    return sorted({part_size for part_size in part_sizes if part_size > 0 and -(-size // part_size) == parts},
+                  key=part_sizes.index)
+
+
+def hash_local_file(file_path, part_sizes=()):
+    # Returns the md5 and sha1 (what shasum gives) of a file and the multipart ETag it would have for each of part_sizes,
+    # all from one read of the file
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    parts = {part_size: {"md5": hashlib.md5(), "filled": 0, "digests": []} for part_size in part_sizes}
+    # one buffer is reused for every read rather than allocating a new one each time
+    read_buffer = bytearray(hash_read_bytes)
+    with open(file_path, "rb", buffering=0) as local_file:
+        while True:
+            read_bytes = local_file.readinto(read_buffer)
+            if not read_bytes:
+                break
+            buffer = memoryview(read_buffer)[:read_bytes]
+            md5.update(buffer)
+            sha1.update(buffer)
+            for part_size, part in parts.items():
+                view = buffer
+                while view:
+                    take = min(len(view), part_size - part["filled"])
+                    part["md5"].update(view[:take])
+                    part["filled"] += take
+                    view = view[take:]
+                    if part["filled"] == part_size:
+                        part["digests"].append(part["md5"].digest())
+                        part["md5"] = hashlib.md5()
+                        part["filled"] = 0
+    etags = {}
+    for part_size, part in parts.items():
+        if part["filled"]:
+            part["digests"].append(part["md5"].digest())
+        etags[part_size] = f"{hashlib.md5(b''.join(part['digests'])).hexdigest()}-{len(part['digests'])}"
+    return {"md5": md5.hexdigest(), "sha1": sha1.hexdigest(), "etags": etags}
+
+
+def open_hash_cache(cache_path):
+    # Opens (or creates) the SQLite file that keeps the hashes of local files
+    hash_cache = sqlite3.connect(cache_path)
+    hash_cache.execute(
+        "CREATE TABLE IF NOT EXISTS file_hashes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+        "md5 TEXT, sha1 TEXT)"
+    )
+    hash_cache.execute(
+        "CREATE TABLE IF NOT EXISTS file_etags (path TEXT, part_size INTEGER, etag TEXT, PRIMARY KEY (path, part_size))"
+    )
+    return hash_cache
+
+
+def get_cached_hashes(hash_cache, local_file, part_sizes):
+    # Returns the cached hashes of a local file, or None if it changed since (by size, mtime or inode)
+    # or any of part_sizes' ETags weren't worked out then
+    cached_row = hash_cache.execute("SELECT size, mtime_ns, inode, md5, sha1 FROM file_hashes WHERE path = ?",
+                                    (local_file["Path"],)).fetchone()
+    if cached_row is None or tuple(cached_row[:3]) != (local_file["Size"], local_file["Mtime"], local_file["Inode"]):
+        return None
+    etags = dict(hash_cache.execute("SELECT part_size, etag FROM file_etags WHERE path = ?", (local_file["Path"],)))
+    if any(part_size not in etags for part_size in part_sizes):
+        return None
+    return {"md5": cached_row[3], "sha1": cached_row[4], "etags": etags}
+
+
+def cache_hashes(hash_cache, hashed_files):
+    # Write the hashes of a batch of (local file, hashes) to the cache, replacing any from before the files changed
+    with hash_cache:
+        for local_file, hashes in hashed_files:
+            hash_cache.execute("DELETE FROM file_etags WHERE path = ?", (local_file["Path"],))
+            hash_cache.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?, ?)",
+                               (local_file["Path"], local_file["Size"], local_file["Mtime"], local_file["Inode"],
+                                hashes["md5"], hashes["sha1"]))
+            hash_cache.executemany("INSERT INTO file_etags VALUES (?, ?, ?)",
+                                   [(local_file["Path"], part_size, etag) for part_size, etag in hashes["etags"].items()])
+
+
+def hash_local_files(hash_jobs, workers=1, hash_cache=None):
+    # Returns {path: hashes} for every (local file, part sizes) in hash_jobs, hashing them across workers processes
+    # Files already in the hash cache aren't read again, and new hashes are cached as they finish
+    hashes = {}
+    uncached_jobs = []
+    for local_file, part_sizes in hash_jobs:
+        cached_hashes = get_cached_hashes(hash_cache, local_file, part_sizes) if hash_cache is not None else None
+        if cached_hashes is not None:
+            hashes[local_file["Path"]] = cached_hashes
+        else:
+            uncached_jobs.append((local_file, part_sizes))
+    print(f"Hashing {len(uncached_jobs)} local files, {len(hashes)} found in the hash cache")
+
+    hashed_files = []
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(hash_local_file, local_file["Path"], part_sizes): local_file
+                   for local_file, part_sizes in uncached_jobs}
+        for future in as_completed(futures):
+            local_file = futures[future]
+            hashes[local_file["Path"]] = future.result()
+            if hash_cache is not None:
+                hashed_files.append((local_file, hashes[local_file["Path"]]))
+                if len(hashed_files) >= hash_cache_batch:
+                    cache_hashes(hash_cache, hashed_files)
+                    hashed_files = []
+    if hashed_files:
+        cache_hashes(hash_cache, hashed_files)
+    return hashes
+
+
+def find_checksum_mismatches(source_files, dest_files, relative_paths, workers=1, multipart_chunk_sizes=(), hash_cache=None):
+    # Returns the relative paths whose contents differ, hashing the local side(s) across workers processes
+    hash_jobs = []
+    part_sizes_by_path = {}
+    for relative_path in relative_paths:
+        source_file, dest_file = source_files[relative_path], dest_files[relative_path]
+        etag = source_file.get("ETag") or dest_file.get("ETag")
+        part_sizes = get_etag_part_sizes(source_file["Size"], etag, multipart_chunk_sizes) if etag and "-" in etag else []
+        part_sizes_by_path[relative_path] = part_sizes
+        for local_file in (source_file, dest_file):
+            if "Path" in local_file:
+                hash_jobs.append((local_file, part_sizes))
+    hashes = hash_local_files(hash_jobs, workers, hash_cache)
+
+    mismatches = []
+    for relative_path in relative_paths:
+        checksums = []
+        for side_file in (source_files[relative_path], dest_files[relative_path]):
+            if "Path" in side_file:
+                file_hashes = hashes[side_file["Path"]]
+                part_sizes = part_sizes_by_path[relative_path]
+                checksums.append({file_hashes["etags"][part_size] for part_size in part_sizes} if part_sizes
+                                 else {file_hashes["md5"]})
+            else:
+                checksums.append({side_file["ETag"]})
+        # the two sides match if any of the ETags the local file could have is the one s3 has
+        if not checksums[0] & checksums[1]:
+            mismatches.append(relative_path)
+    return mismatches
+
+
+def verify_sync_status(source_path, dest_path, s3=None, use_checksum=False, workers=1, multipart_chunk_sizes=(), hash_cache=None):
+    # Returns a row for every file that isn't in sync between source_path and dest_path
+    source_files = list_files(source_path, s3)
+    dest_files = list_files(dest_path, s3)
+    print(f"Listed {len(source_files)} files in {source_path} and {len(dest_files)} files in {dest_path}")
+    missing, extra, size_mismatch = compare_listings(source_files, dest_files)
+    checksum_mismatch = []
+    if use_checksum:
+        same_size = sorted(source_files.keys() & dest_files.keys() - set(size_mismatch))
+        checksum_mismatch = find_checksum_mismatches(source_files, dest_files, same_size, workers, multipart_chunk_sizes, hash_cache)
+
+    report = []
+    for status, relative_paths in (("missing_in_destination", missing), ("extra_in_destination", extra),
+                                   ("size_differs", size_mismatch), ("checksum_differs", checksum_mismatch)):
+        for relative_path in relative_paths:
+            report.append({"source_path": source_path, "dest_path": dest_path, "relative_path": relative_path,
+                           "status": status, "source_size": source_files.get(relative_path, {}).get("Size"),
+                           "dest_size": dest_files.get(relative_path, {}).get("Size")})
+    if report:
+        print(f"Failed to sync: {source_path} -> {dest_path}")
+        for status in ("missing_in_destination", "extra_in_destination", "size_differs", "checksum_differs"):
+            status_count = sum(1 for row in report if row["status"] == status)
+            if status_count:
+                print(f"  {status}: {status_count}")
+    else:
+        print(f"Sync is up to date: {source_path} -> {dest_path}")
+    return report
+
+
+def output_report(report_file, report):
+    # Write every file that isn't in sync to a csv
+    fieldnames = ["source_path", "dest_path", "relative_path", "status", "source_size", "dest_size"]
+    with open(report_file, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(report)
+    print(f"CSV file '{report_file}' created with {len(report)} entries.")
+
+
+def main():
+    cli_args = _cli()
+    source_paths = [cli_args["source_path"]]
+    if cli_args["verify_list"]:
+        with open(cli_args["verify_list"], 'r') as verify_list:
+            source_paths = [line.strip() for line in verify_list if line.strip()]
+
+    s3 = None
+    if any(path.startswith("s3://") for path in source_paths + [cli_args["dest_path"]]):
+        s3cfg = read_s3cfg()
+        s3 = create_s3_client(cli_args["host"] or s3cfg.get("host") or "https://s3.msi.umn.edu",
+                              cli_args["access_key"] or s3cfg.get("access_key"),
+                              cli_args["secret_key"] or s3cfg.get("secret_key"), cli_args["max_attempts"])
+
+    multipart_chunk_sizes = [chunk_size_mb * 1024 * 1024 for chunk_size_mb in cli_args["multipart_chunk_sizes_mb"]]
+    hash_cache = open_hash_cache(cli_args["hash_cache"]) if cli_args["hash_cache"] else None
+    report = []
+    for source_path in source_paths:
+        report.extend(verify_sync_status(source_path, cli_args["dest_path"], s3, cli_args["checksum"],
+                                         cli_args["workers"], multipart_chunk_sizes, hash_cache))
+    if hash_cache is not None:
+        hash_cache.close()
+    if cli_args["report"]:
+        output_report(cli_args["report"], report)
+    sys.exit(1 if report else 0)
+
+
+if __name__ == '__main__':
+    main()